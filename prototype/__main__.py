@@ -1,15 +1,17 @@
 import sys
 import random
-import ctypes
-from typing import List
-import antlr4
-
-from prototype.interpreter import FuncValue, ListValue, NativeValue, Scope, TableValue, Value
-from .syntax.LanguageLexer import LanguageLexer
-from .syntax.LanguageParser import LanguageParser
-from .syntax.LanguageListener import LanguageListener
-
-class Visitor(LanguageListener):
+import argparse
+from typing import Callable, Dict, List
+
+from prototype.interpreter import FuncValue, ListValue, NativeValue, Scope, StringBuilderValue, TableValue, Value, copy_on_write, range_, string_value
+from prototype.nodes import Program
+from prototype import arrays, bulk, cache, closures, collector, ffi, parallel, persistent, stackeval, transpile, vm
+from prototype.inline_cache import MemberCache
+from prototype.memo import Memo, memoize
+from prototype.modules import registry
+from prototype.bytecode import compile_program, disassemble
+
+class Visitor:
 	scope_stack: List[Scope]
 
 	def __init__(self):
@@ -28,28 +30,57 @@ class Visitor(LanguageListener):
 	def pop_scope(self):
 		del self.scope_stack[-1]
 
+# wrap_func(object, is_pure, arg_spec, returns?): arg_spec maps argument names to C types like
+# "c_char_p", see `prototype.ffi`, and without `returns` the function returns nothing
 def wrap_func(scope: Scope) -> FuncValue:
 	arg_spec = scope.get('arg_spec').value
 	is_pure = scope.get('is_pure').value
 	func = scope.get('object').value
-
-	def wrapped(scope_in: Scope) -> Value:
-		wrapped_args = []
-		for arg, c_type in arg_spec.items():
-			assert isinstance(c_type.value, str)
-			wrapped_args.append(getattr(ctypes, c_type.value)(scope_in.get(arg).value.encode()))
-		return Value(func(*wrapped_args))
-
-	return FuncValue(arg_spec.keys(), is_pure, wrapped)
-
-def run(file: str) -> Value:
-	input_stream = antlr4.FileStream(file)
+	returns = scope.get('returns').value if scope.has_own('returns') else 'void'
+
+	arg_types = { name: c_type.value for name, c_type in arg_spec.items() }
+	return FuncValue(list(arg_types), is_pure, ffi.Signature(func, arg_types, returns))
+
+def parse(file: str) -> Program:
+	with open(file, 'rb') as f:
+		source = f.read()
+	digest = cache.source_hash(source)
+	program = cache.load(file, digest)
+	if program is not None:
+		return program
+
+	program = collector.parsing(lambda: parse_source(source))
+	cache.store(file, digest, program)
+	return program
+
+def parse_source(source: bytes) -> Program:
+	# ANTLR is only imported when something actually needs parsing, cached runs never load it
+	import antlr4
+	from prototype.fold import fold
+	from prototype.lower import lower
+	from prototype.resolve import resolve
+	from prototype.syntax.LanguageLexer import LanguageLexer
+	from prototype.syntax.LanguageParser import LanguageParser
+
+	input_stream = antlr4.InputStream(source.decode('ascii'))
 	lexer = LanguageLexer(input_stream)
 	stream = antlr4.CommonTokenStream(lexer)
 	parser = LanguageParser(stream)
 
-	tree = parser.program()
-	walker = antlr4.ParseTreeWalker()
+	# Lower straight away so that the parse tree and token stream can be freed, folding constants
+	# before resolving so that depths match the folded tree
+	return resolve(fold(lower(parser.program())))
+
+# Backend name -> function executing a program's statements in the given root scope
+BACKENDS: Dict[str, Callable[[Program, Scope], None]] = {
+	'tree': lambda program, scope: scope.evaluate_program(program),
+	'vm': vm.execute,
+	'closure': closures.execute,
+	'python': transpile.execute,
+	'stack': stackeval.execute,
+}
+
+def run(file: str, backend: str = 'tree') -> Value:
 	visitor = Visitor()
 
 	builtins = {
@@ -58,30 +89,48 @@ def run(file: str) -> Value:
 		# 'println': FuncValue(['text'], False, lambda scope: print(scope.get('text').value)),
 		'debug': FuncValue([], False, lambda scope: print(scope.scope)),
 		'maybe': FuncValue([], False, lambda scope: Value(random.choice([True, False]))),
-		'str': FuncValue(['something'], True, lambda scope: Value(str(scope.get('something').value))),
+		'str': bulk.direct(['something'], lambda something: string_value(str(something.value)), str),
 		'table': FuncValue([], True, lambda scope: TableValue({})),
 		'list': FuncValue([], True, lambda scope: ListValue([])),
+		'ptable': FuncValue(['entries'], True, persistent.ptable),
+		'plist': FuncValue(['items'], True, persistent.plist),
+		'range': FuncValue(['n'], True, range_),
+		'string_builder': FuncValue([], True, lambda scope: StringBuilderValue()),
+		'array': FuncValue(['items'], True, arrays.array),
 		'split': FuncValue(['text', 'splitter'], True, lambda scope: ListValue([
-			Value(it) for it in
+			string_value(it) for it in
 			scope.get('text').value.split(scope.get('splitter').value)
 		])),
+		'map': FuncValue(['items', 'callback'], True, bulk.map_),
+		'filter': FuncValue(['items', 'callback'], True, bulk.filter_),
+		'reduce': FuncValue(['items', 'callback', 'initial'], True, bulk.reduce_),
+		'sum': FuncValue(['items'], True, bulk.sum_),
+		'count_if': FuncValue(['items', 'callback'], True, bulk.count_if),
+		'join': FuncValue(['items', 'separator'], True, bulk.join),
+		'op': bulk.operators(),
 		'py_eval': FuncValue(['code'], False, lambda scope: Value(eval(scope.get('code').value))),
 		'py_exec': FuncValue(['code'], False, lambda scope: Value(exec(scope.get('code').value))),
 		'to_native': FuncValue(['object'], True, lambda scope: NativeValue(scope.get('object').value)),
 		'get_native': FuncValue(['object', 'key'], True, lambda scope: NativeValue(scope.get('object').value.__getattr__(scope.get('key').value))),
-		'wrap_func': FuncValue(['object', 'is_pure', 'arg_spec'], True, wrap_func),
-		'import': FuncValue(['path'], True, lambda scope: run(scope.get('path').value)),
+		'wrap_func': FuncValue(['object', 'is_pure', 'arg_spec', 'returns'], True, wrap_func),
+		'memoize': FuncValue(['func', 'size'], True, memoize),
+		'par_map': FuncValue(['items', 'callback'], False, parallel.par_map),
+		'import': FuncValue(['path'], True, lambda scope: registry.load(scope.get('path').value, lambda path: run(path, backend))),
 	}
 
 	for name, value in builtins.items():
 		visitor.get_root_scope().new(name, value)
 
-	# Interpret
-	walker.walk(visitor, tree)
-
-	tree.removeLastChild() # Remove the EOF token
-	for child in tree.getChildren():
-		visitor.get_root_scope().evaluate_stat(child)
+	# Interpret, using the module from `python -m prototype compile` when there is an up to date one
+	compiled = transpile.load_compiled(file) if backend == 'python' else None
+	if compiled is not None:
+		collector.started()
+		compiled.execute(visitor.get_root_scope())
+	else:
+		# The stack backend is for programs nesting too deep for the others, loading them too
+		program = stackeval.load(parse, file) if backend == 'stack' else parse(file)
+		collector.started()
+		BACKENDS[backend](program, visitor.get_root_scope())
 
 	# Invoke main, if it exists
 	if visitor.get_root_scope().has('main'):
@@ -89,12 +138,55 @@ def run(file: str) -> Value:
 		if isinstance(main, FuncValue):
 			main.invoke(visitor.get_root_scope(), [])
 
-	# print(tree.toStringTree(recog = parser))
+	# print(program)
 	# print('Global scope breakdown:')
 	# for name, value in visitor.get_root_scope().scope.items():
 	# 	print(f'{name} = {'None' if value is None else value.value}')
 
 	return visitor.get_root_scope().returned_value
 
+# Name -> counters reported by `--stats`
+STATS: Dict[str, Callable[[], Dict[str, int]]] = {
+	'modules': registry.stats,
+	'member caches': MemberCache.stats,
+	'memo': Memo.stats,
+	'parallel': parallel.stats,
+	'copy on write': lambda: dict(copy_on_write),
+	'gc': collector.stats,
+}
+
+def print_stats():
+	for name, stats in STATS.items():
+		print(f'{name}: ' + ' '.join(f'{key}={value}' for key, value in stats().items()), file = sys.stderr)
+
+def compile_file(file: str, output: str):
+	with open(file, 'rb') as f:
+		digest = cache.source_hash(f.read())
+	with open(output, 'w') as f:
+		f.write(transpile.transpile(parse(file), file, digest))
+
 if __name__ == '__main__':
-	run(sys.argv[1])
+	if sys.argv[1:2] == ['compile']:
+		arg_parser = argparse.ArgumentParser(prog = 'prototype compile', description = 'Transpile a program into a Python module. Modules written to the default output path are picked up by `--backend python`, including for imports.')
+		arg_parser.add_argument('file')
+		arg_parser.add_argument('-o', '--output', help = 'defaults to foo_pipe.py for foo.pipe')
+		args = arg_parser.parse_args(sys.argv[2:])
+		compile_file(args.file, args.output or transpile.compiled_path(args.file))
+		sys.exit()
+
+	arg_parser = argparse.ArgumentParser(prog = 'prototype')
+	arg_parser.add_argument('file')
+	arg_parser.add_argument('--backend', choices = BACKENDS.keys(), default = 'tree')
+	arg_parser.add_argument('--dis', action = 'store_true', help = 'print the bytecode for the file instead of running it')
+	arg_parser.add_argument('--no-cache', action = 'store_true', help = 'always parse instead of using __pipecache__')
+	arg_parser.add_argument('--stats', action = 'store_true', help = 'print runtime counters to stderr after running')
+	arg_parser.add_argument('--gc-freeze', action = 'store_true', help = 'move everything alive after startup out of the garbage collector\'s reach')
+	args = arg_parser.parse_args()
+	cache.enabled = not args.no_cache
+	collector.freeze = args.gc_freeze
+	if args.dis:
+		print(disassemble(compile_program(parse(args.file), args.file)))
+	else:
+		run(args.file, args.backend)
+		if args.stats:
+			print_stats()
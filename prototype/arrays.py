@@ -0,0 +1,111 @@
+from typing import Any, Callable
+
+from prototype.interpreter import BOXES, ListValue, Method, Scope, SeqValue, Value, box
+
+# Optional: without NumPy everything works but `array()`
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+
+# A numeric array backed by a NumPy ndarray. Operators run element-wise over the whole array in one
+# call, against another array of the same length or a single number, and comparisons give boolean
+# arrays that `select` takes as a mask. Arrays are made from and turned back into lists explicitly,
+# with `array(items)` and `to_list()`.
+#
+# A number on the left of an arithmetic operator works too (`2 * a`), comparisons need the array on
+# the left.
+class ArrayValue(Value):
+	__slots__ = ()
+
+	def __init__(self, value: Any):
+		super().__init__(value)
+
+	def add(self, other: Value) -> 'ArrayValue': return ArrayValue(self.value + other.value)
+	def sub(self, other: Value) -> 'ArrayValue': return ArrayValue(self.value - other.value)
+	def mul(self, other: Value) -> 'ArrayValue': return ArrayValue(self.value * other.value)
+	# Dividing by zero raises, like it does for numbers
+	def div(self, other: Value) -> 'ArrayValue':
+		with numpy.errstate(divide = 'raise', invalid = 'raise'):
+			return ArrayValue(self.value / other.value)
+	def mod(self, other: Value) -> 'ArrayValue':
+		with numpy.errstate(divide = 'raise', invalid = 'raise'):
+			return ArrayValue(self.value % other.value)
+	def eq(self, other: Value) -> 'ArrayValue': return ArrayValue(self.value == other.value)
+	def neq(self, other: Value) -> 'ArrayValue': return ArrayValue(self.value != other.value)
+	def gt(self, other: Value) -> 'ArrayValue': return ArrayValue(self.value > other.value)
+	def gteq(self, other: Value) -> 'ArrayValue': return ArrayValue(self.value >= other.value)
+	def lt(self, other: Value) -> 'ArrayValue': return ArrayValue(self.value < other.value)
+	def lteq(self, other: Value) -> 'ArrayValue': return ArrayValue(self.value <= other.value)
+
+	# Methods
+	def _reduce(self, reduce: Callable[[Any], Any]) -> Value:
+		if not len(self.value):
+			raise RuntimeError("Attempted to reduce an empty array.")
+		return box(reduce(self.value).item())
+
+	def _sum(self, scope: Scope) -> Value:
+		return box(self.value.sum().item())
+
+	def _min(self, scope: Scope) -> Value:
+		return self._reduce(numpy.min)
+
+	def _max(self, scope: Scope) -> Value:
+		return self._reduce(numpy.max)
+
+	def _mean(self, scope: Scope) -> Value:
+		return self._reduce(numpy.mean)
+
+	def _count(self, scope: Scope) -> Value:
+		return box(len(self.value))
+
+	def _get(self, scope: Scope) -> Value:
+		return box(self.value[int(scope.get('index').value)].item())
+
+	# The items where `mask`, a boolean array of the same length, is true
+	def _select(self, scope: Scope) -> 'ArrayValue':
+		mask = scope.get('mask')
+		if type(mask) is not ArrayValue or mask.value.dtype != bool or len(mask.value) != len(self.value):
+			raise RuntimeError("Expected a boolean array of the same length as a mask (value is: " + str(mask) + ")")
+		return ArrayValue(self.value[mask.value])
+
+	def _to_list(self, scope: Scope) -> ListValue:
+		return ListValue([box(item) for item in self.value.tolist()])
+
+
+ArrayValue.methods = {
+	'sum': Method([], True, ArrayValue._sum),
+	'min': Method([], True, ArrayValue._min),
+	'max': Method([], True, ArrayValue._max),
+	'mean': Method([], True, ArrayValue._mean),
+	'count': Method([], True, ArrayValue._count),
+	'get': Method(['index'], True, ArrayValue._get),
+	'select': Method(['mask'], True, ArrayValue._select),
+	'to_list': Method([], True, ArrayValue._to_list),
+}
+
+if numpy is not None:
+	BOXES[numpy.ndarray] = ArrayValue
+
+
+# Builtin: array(items) makes an array of the numbers in a list, sequence or other array
+def array(scope: Scope) -> ArrayValue:
+	if numpy is None:
+		raise RuntimeError("array() needs NumPy, which is not installed.")
+	items = scope.get('items')
+	kind = type(items)
+	if kind is ArrayValue:
+		return ArrayValue(items.value.copy())
+	elif kind is ListValue:
+		values = [item.value for item in items.value]
+	elif kind is SeqValue:
+		values = [item.value for item in items.value(scope)]
+	else:
+		raise RuntimeError("array() expects a list, sequence or array (value is: " + str(items) + ")")
+
+	value = numpy.array(values)
+	# Empty lists give float arrays, anything but numbers and booleans is refused
+	if value.dtype.kind not in 'biuf':
+		raise RuntimeError("Arrays can only hold numbers and booleans.")
+	return ArrayValue(value)
@@ -0,0 +1,151 @@
+import operator
+from typing import Any, Callable, Iterable, List, Optional
+
+from prototype.interpreter import FALSE, TRUE, FuncValue, ListValue, Scope, SeqValue, TableValue, Value, bind, box, string_value
+
+
+# The callable of a builtin that works on values directly instead of reading them from a scope. Bulk
+# builtins call `func` with the items as is, without making a scope per item, and `raw`, when there
+# is one, is the same operation on the Python values inside.
+class Direct:
+	__slots__ = ('func', 'args', 'raw')
+	func: Callable[..., Value]
+	args: List[str]
+	raw: Optional[Callable[..., Any]]
+
+	def __init__(self, func: Callable[..., Value], args: List[str], raw: Optional[Callable[..., Any]] = None):
+		self.func = func
+		self.args = args
+		self.raw = raw
+
+	def __call__(self, scope: Scope) -> Value:
+		return self.func(*[scope.get(name) for name in self.args])
+
+
+def direct(args: List[str], func: Callable[..., Value], raw: Optional[Callable[..., Any]] = None) -> FuncValue:
+	return FuncValue(args, True, Direct(func, args, raw))
+
+
+# Operator name -> the same operator as a function on plain Python values
+RAW_OPERATORS = {
+	'add': operator.add,
+	'sub': operator.sub,
+	'mul': operator.mul,
+	'div': operator.truediv,
+	'mod': operator.mod,
+	'eq': operator.eq,
+	'neq': operator.ne,
+	'gt': operator.gt,
+	'gteq': operator.ge,
+	'lt': operator.lt,
+	'lteq': operator.le,
+}
+
+def operator_function(name: str, raw: Callable[[Any, Any], Any]) -> FuncValue:
+	return direct(['a', 'b'], lambda a, b: getattr(a, name)(b), raw)
+
+
+# Builtin: the `op` table, the operators as functions to hand to bulk builtins, like
+# `reduce(items, op.mul, 1)`
+def operators() -> TableValue:
+	entries = { name: operator_function(name, raw) for name, raw in RAW_OPERATORS.items() }
+	entries['not'] = direct(['a'], lambda a: FALSE if a.value else TRUE, operator.not_)
+	return TableValue(entries)
+
+
+def items_of(scope: Scope, name: str = 'items') -> Iterable[Value]:
+	items = scope.get(name)
+	if type(items) is ListValue:
+		return items.value
+	elif type(items) is SeqValue:
+		return items.value(scope)
+	raise RuntimeError("Expected a list or sequence (value is: " + str(items) + ")")
+
+
+# Calls `callback` like the caller of the builtin would, but as a plain Python function. Builtins
+# taking values directly are called as is; functions of the program get one child of the caller's
+# scope that is emptied and reused for every item, nothing can hold on to the scope of a finished
+# call.
+def caller(scope: Scope, name: str = 'callback') -> Callable[..., Value]:
+	callback = scope.get(name)
+	if not isinstance(callback, FuncValue):
+		raise RuntimeError("Attempted to invoke a non-FuncValue value (value is: " + str(callback) + ")")
+	# The builtin runs in a pure scope of its own, what matters is where it was called from
+	outer = scope.parent
+	if not callback.is_pure and outer.pure:
+		raise RuntimeError("Cannot invoke impure functions in a pure scope.")
+	if type(callback.value) is Direct:
+		return callback.value.func
+
+	body, is_pure = callback.value, callback.is_pure
+	child = outer.make_child_scope(is_pure)
+	def call(*values: Value) -> Value:
+		if child.scope:
+			child.reset()
+		child.pure = is_pure
+		bind(child, callback, values)
+		return body(child)
+	return call
+
+
+# Builtins
+def map_(scope: Scope) -> ListValue:
+	items = items_of(scope)
+	call = caller(scope)
+	return ListValue([call(item) for item in items])
+
+
+def filter_(scope: Scope) -> ListValue:
+	items = items_of(scope)
+	call = caller(scope)
+	return ListValue([item for item in items if call(item).is_truthy()])
+
+
+def count_if(scope: Scope) -> Value:
+	items = items_of(scope)
+	call = caller(scope)
+	return box(sum(1 for item in items if call(item).is_truthy()))
+
+
+# reduce(items, callback, initial?): without an initial value the first item is the start
+def reduce_(scope: Scope) -> Value:
+	items = iter(items_of(scope))
+	if scope.has_own('initial'):
+		initial = scope.get('initial')
+	else:
+		initial = next(items, None)
+		if initial is None:
+			raise RuntimeError("Attempted to reduce an empty list without an initial value.")
+
+	call = caller(scope)
+	callback = scope.get('callback')
+	raw = callback.value.raw if type(callback.value) is Direct else None
+	result = initial
+	if raw is not None and type(result) is Value:
+		# Operators on plain values only box the result
+		plain = result.value
+		for item in items:
+			if type(item) is not Value:
+				result = call(box(plain), item)
+				break
+			plain = raw(plain, item.value)
+		else:
+			return box(plain)
+	for item in items:
+		result = call(result, item)
+	return result
+
+
+def sum_(scope: Scope) -> Value:
+	items = items_of(scope)
+	try:
+		return box(sum(item.value for item in items))
+	except TypeError:
+		raise RuntimeError("sum() only adds numbers, use reduce(items, op.add) for anything else.")
+
+
+# join(items, separator): strings are joined as is, anything else as `str` would show it
+def join(scope: Scope) -> Value:
+	items = items_of(scope)
+	separator = scope.get('separator').value
+	return string_value(separator.join(item.value if type(item.value) is str else str(item.value) for item in items))
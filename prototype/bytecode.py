@@ -0,0 +1,270 @@
+from typing import Any, Callable, Dict, List, Tuple
+
+from prototype.inline_cache import MemberCache
+from prototype.interpreter import NONE, box, string_literal
+from prototype.nodes import Assign, BinOp, Block, For, Func, If, Invoke, Literal, Logical, Member, Name, Node, Program, Return, String, Template, UnaryOp, Var
+from prototype.resolve import declarations
+
+
+# Opcodes, numbered by how often they run in typical programs. The VM tests them in this order.
+LOAD_LOCAL = 0         # arg: (depth, name), see `Scope.get_at`
+LOAD_CONST = 1         # arg: Value, shared by every run since values never change
+BINARY_OP = 2          # arg: the `Value` method name, like 'add'
+BINARY_OP_CONST = 3    # arg: (method name, Value), for a literal right operand
+STORE_LOCAL = 4        # arg: (depth, name), assigns to an existing variable
+POP_JUMP_IF_FALSE = 5  # arg: target, the same test as `Value.is_truthy`
+JUMP = 6               # arg: target
+INC = 7                # arg: (depth, name, keep), see `Scope.step`, pushes the new value with keep
+POP_TOP = 8
+CALL = 9               # arg: argument count
+TAIL_CALL = 10         # arg: argument count, replaces the current frame for compiled functions
+RETURN_VALUE = 11
+LOAD_GLOBAL = 12       # arg: name, see `Scope.get_global`
+GET_MEMBER = 13        # arg: the site's MemberCache
+STORE_NEW = 14         # arg: (name, is_const), declares a variable in the current scope
+CLEAR_SCOPE = 15       # empties the current scope, for the next iteration of a loop
+JUMP_IF_FALSE_OR_POP = 16
+JUMP_IF_TRUE_OR_POP = 17
+UNARY_NOT = 18
+DEC = 19               # arg: (depth, name, keep)
+STORE_NAME = 20        # arg: name, assigns to an existing variable
+PUSH_SCOPE = 21        # arg: is_pure, None to keep the current scope's purity
+POP_SCOPE = 22
+SET_RETURNED = 23      # stores TOS into the scope's returned_value, leaving it on the stack
+MAKE_FUNC = 24         # arg: (args, is_pure, code)
+FORMAT = 25            # arg: the Template's strings, pops one value per interpolated expression
+
+OPNAMES = [
+	'LOAD_LOCAL', 'LOAD_CONST', 'BINARY_OP', 'BINARY_OP_CONST', 'STORE_LOCAL', 'POP_JUMP_IF_FALSE', 'JUMP',
+	'INC', 'POP_TOP', 'CALL', 'TAIL_CALL', 'RETURN_VALUE', 'LOAD_GLOBAL', 'GET_MEMBER', 'STORE_NEW',
+	'CLEAR_SCOPE', 'JUMP_IF_FALSE_OR_POP', 'JUMP_IF_TRUE_OR_POP', 'UNARY_NOT', 'DEC', 'STORE_NAME',
+	'PUSH_SCOPE', 'POP_SCOPE', 'SET_RETURNED', 'MAKE_FUNC', 'FORMAT',
+]
+
+
+Instruction = Tuple[int, Any]
+
+
+class Code:
+	__slots__ = ('name', 'instructions')
+	name: str
+	instructions: List[Instruction]
+
+	def __init__(self, name: str, instructions: List[Instruction]):
+		self.name = name
+		self.instructions = instructions
+
+	def __repr__(self) -> str:
+		return f'<code {self.name}, {len(self.instructions)} instructions>'
+
+
+class Compiler:
+	instructions: List[Instruction]
+
+	def __init__(self):
+		self.instructions = []
+
+	def emit(self, op: int, arg: Any = None) -> int:
+		self.instructions.append((op, arg))
+		return len(self.instructions) - 1
+
+	# Points the jump at `index` to the next instruction to be emitted
+	def patch(self, index: int):
+		self.instructions[index] = (self.instructions[index][0], len(self.instructions))
+
+	# Compiles a statement. With `keep` it leaves its value on the stack, like `Scope.evaluate_stat`
+	# returns it, otherwise the stack is left as it was.
+	def compile_stat(self, stat: Node, keep: bool = True):
+		kind = type(stat)
+		if kind is Var or kind is Assign:
+			self.compile_expr(stat.value)
+			if kind is Var:
+				self.emit(STORE_NEW, (stat.name, stat.is_const))
+			elif stat.depth is None:
+				self.emit(STORE_NAME, stat.name)
+			else:
+				self.emit(STORE_LOCAL, (stat.depth, stat.name))
+			if keep:
+				self.emit(LOAD_CONST, NONE)
+			return
+		elif kind is Return:
+			self.compile_expr(stat.value)
+			self.emit(SET_RETURNED)
+		elif kind is UnaryOp and stat.op != 'not':
+			# `i++` as a statement, like a loop's step, does not need its value
+			self.emit(INC if stat.op == 'inc' else DEC, (stat.operand.depth, stat.operand.name, keep))
+			return
+		else:
+			self.compile_expr(stat)
+		if not keep:
+			self.emit(POP_TOP)
+
+	def compile_expr(self, expr: Node, make_scope: bool = True):
+		if not make_scope and type(expr) is Block:
+			self.compile_block(expr, make_scope = False)
+		else:
+			COMPILERS[type(expr)](self, expr)
+
+	def compile_block(self, block: Block, make_scope: bool = True):
+		if make_scope:
+			self.emit(PUSH_SCOPE, block.is_pure)
+		exits = []
+		for statement in block.body:
+			if type(statement) is Return:
+				self.compile_expr(statement.value)
+				if make_scope:
+					self.emit(POP_SCOPE)
+				exits.append(self.emit(JUMP))
+				# Anything after a return is unreachable
+				break
+			self.compile_stat(statement, keep = False)
+		else:
+			self.emit(LOAD_CONST, NONE)
+			if make_scope:
+				self.emit(POP_SCOPE)
+		for index in exits:
+			self.patch(index)
+
+	def _literal(self, expr: Literal):
+		self.emit(LOAD_CONST, box(expr.value))
+
+	def _string(self, expr: String):
+		self.emit(LOAD_CONST, string_literal(expr.text))
+
+	def _template(self, expr: Template):
+		for part in expr.exprs:
+			self.compile_expr(part)
+		self.emit(FORMAT, expr.strings)
+
+	def _name(self, expr: Name):
+		if expr.depth is None:
+			self.emit(LOAD_GLOBAL, expr.name)
+		else:
+			self.emit(LOAD_LOCAL, (expr.depth, expr.name))
+
+	def _member(self, expr: Member):
+		self.compile_expr(expr.target)
+		self.emit(GET_MEMBER, MemberCache(expr.name))
+
+	def _unary_op(self, expr: UnaryOp):
+		if expr.op == 'not':
+			self.compile_expr(expr.operand)
+			self.emit(UNARY_NOT)
+		else:
+			self.emit(INC if expr.op == 'inc' else DEC, (expr.operand.depth, expr.operand.name, True))
+
+	def _bin_op(self, expr: BinOp):
+		self.compile_expr(expr.left)
+		if type(expr.right) is Literal:
+			self.emit(BINARY_OP_CONST, (expr.op, box(expr.right.value)))
+		else:
+			self.compile_expr(expr.right)
+			self.emit(BINARY_OP, expr.op)
+
+	def _logical(self, expr: Logical):
+		self.compile_expr(expr.left)
+		jump = self.emit(JUMP_IF_FALSE_OR_POP if expr.op == 'and' else JUMP_IF_TRUE_OR_POP)
+		self.compile_expr(expr.right)
+		self.patch(jump)
+
+	def _func(self, expr: Func):
+		self.emit(MAKE_FUNC, (expr.args, expr.is_pure, compile_function(expr)))
+
+	def _invoke(self, expr: Invoke):
+		self.compile_expr(expr.func)
+		for arg in expr.args:
+			self.compile_expr(arg)
+		self.emit(TAIL_CALL if expr.tail else CALL, len(expr.args))
+
+	def _if(self, expr: If):
+		self.compile_expr(expr.cond)
+		to_else = self.emit(POP_JUMP_IF_FALSE)
+		self.compile_expr(expr.then, make_scope = False)
+		to_end = self.emit(JUMP)
+		self.patch(to_else)
+		if expr.else_ is not None:
+			self.compile_expr(expr.else_, make_scope = False)
+		else:
+			self.emit(LOAD_CONST, NONE)
+		self.patch(to_end)
+
+	def _for(self, expr: For):
+		body = expr.statements()
+		is_pure = expr.is_pure()
+		self.emit(PUSH_SCOPE, False)
+		self.compile_expr(expr.init)
+		self.emit(POP_TOP)
+		top = len(self.instructions)
+		self.compile_expr(expr.cond)
+		to_end = self.emit(POP_JUMP_IF_FALSE)
+		# A pure body gets a new scope every iteration, see `For`
+		if is_pure:
+			self.emit(PUSH_SCOPE, True)
+		elif declarations(body):
+			self.emit(CLEAR_SCOPE)
+		exits = []
+		for statement in body:
+			if type(statement) is Return:
+				self.compile_expr(statement.value)
+				if is_pure:
+					self.emit(POP_SCOPE)
+				exits.append(self.emit(JUMP))
+				break
+			self.compile_stat(statement, keep = False)
+		else:
+			if is_pure:
+				self.emit(POP_SCOPE)
+			self.compile_stat(expr.step, keep = False)
+			self.emit(JUMP, top)
+		self.patch(to_end)
+		self.emit(LOAD_CONST, NONE)
+		for index in exits:
+			self.patch(index)
+		self.emit(POP_SCOPE)
+
+
+# Node type -> compiler method, used by `Compiler.compile_expr`
+COMPILERS: Dict[type, Callable[[Compiler, Any], None]] = {
+	Literal: Compiler._literal,
+	String: Compiler._string,
+	Template: Compiler._template,
+	Name: Compiler._name,
+	Member: Compiler._member,
+	UnaryOp: Compiler._unary_op,
+	BinOp: Compiler._bin_op,
+	Logical: Compiler._logical,
+	Func: Compiler._func,
+	Invoke: Compiler._invoke,
+	Block: Compiler.compile_block,
+	If: Compiler._if,
+	For: Compiler._for,
+}
+
+
+def compile_function(func: Func) -> Code:
+	compiler = Compiler()
+	compiler.compile_stat(func.body)
+	compiler.emit(RETURN_VALUE)
+	return Code(f'<func ({", ".join(func.args)})>', compiler.instructions)
+
+
+def compile_program(program: Program, name: str = '<program>') -> Code:
+	compiler = Compiler()
+	for statement in program.body:
+		compiler.compile_stat(statement, keep = False)
+	compiler.emit(LOAD_CONST, NONE)
+	compiler.emit(RETURN_VALUE)
+	return Code(name, compiler.instructions)
+
+
+def disassemble(code: Code, indent: str = '') -> str:
+	lines = [f'{indent}{code.name}:']
+	nested = []
+	for index, (op, arg) in enumerate(code.instructions):
+		if op == MAKE_FUNC:
+			nested.append(arg[2])
+			arg = arg[2].name
+		lines.append(f'{indent}  {index:4} {OPNAMES[op]:<20} {"" if arg is None and op != LOAD_CONST else repr(arg)}'.rstrip())
+	for inner in nested:
+		lines.append(disassemble(inner, indent + '  '))
+	return '\n'.join(lines)
@@ -0,0 +1,76 @@
+import hashlib
+import os
+import pickle
+import sys
+from typing import Optional
+
+from prototype.nodes import Program
+
+
+# Lowered programs are cached in a `__pipecache__` directory next to their source, much like
+# `__pycache__`. An entry is only used when both the source hash and the interpreter tag match, so
+# editing either the program or the lowering code invalidates it. Entries are pickles, so the cache
+# directory must be as trusted as the sources themselves.
+CACHE_DIR = '__pipecache__'
+
+# Modules that decide what a lowered program looks like, including the generated parser and lexer
+# so that regenerating the grammar invalidates the cache too
+LOWERING_MODULES = [
+	'nodes.py', 'lower.py', 'fold.py', 'resolve.py', 'interpreter.py',
+	os.path.join('syntax', 'LanguageParser.py'), os.path.join('syntax', 'LanguageLexer.py'),
+]
+
+# Set to False (`--no-cache`) to always parse
+enabled = True
+
+
+def _interpreter_tag() -> str:
+	digest = hashlib.sha256(sys.implementation.cache_tag.encode())
+	for module in LOWERING_MODULES:
+		with open(os.path.join(os.path.dirname(__file__), module), 'rb') as f:
+			digest.update(f.read())
+	return digest.hexdigest()[:16]
+
+
+INTERPRETER_TAG = _interpreter_tag()
+
+
+def source_hash(source: bytes) -> str:
+	return hashlib.sha256(source).hexdigest()
+
+
+def cache_path(file: str) -> str:
+	return os.path.join(os.path.dirname(file), CACHE_DIR, f'{os.path.basename(file)}.{INTERPRETER_TAG}.pickle')
+
+
+def load(file: str, digest: str) -> Optional[Program]:
+	if not enabled:
+		return None
+	try:
+		with open(cache_path(file), 'rb') as f:
+			cached_digest, program = pickle.load(f)
+	except Exception:
+		# Missing, truncated, corrupt or simply not a (digest, program) pair: parse again
+		return None
+	if cached_digest != digest or not isinstance(program, Program):
+		return None
+	return program
+
+
+def store(file: str, digest: str, program: Program):
+	if not enabled:
+		return
+	path = cache_path(file)
+	# Write to a temporary file first so that a concurrent run never sees half an entry
+	temp = f'{path}.{os.getpid()}.tmp'
+	try:
+		os.makedirs(os.path.dirname(path), exist_ok = True)
+		with open(temp, 'wb') as f:
+			pickle.dump((digest, program), f, pickle.HIGHEST_PROTOCOL)
+		os.replace(temp, path)
+	except (OSError, RecursionError, pickle.PicklingError):
+		# Read-only locations (and trees too deep to pickle) simply go uncached
+		try:
+			os.remove(temp)
+		except OSError:
+			pass
@@ -0,0 +1,213 @@
+from typing import Any, Callable, Dict, List, Optional
+
+from prototype.inline_cache import MemberCache
+from prototype.interpreter import FALSE, NONE, TRUE, FuncValue, Function, Scope, Value, box, format_template, string_literal
+from prototype.nodes import Assign, BinOp, Block, For, Func, If, Invoke, Literal, Logical, Member, Name, Node, Program, Return, String, Template, UnaryOp, Var
+from prototype.resolve import declarations
+
+
+# Every node is compiled once into a closure taking the scope to run in, so nothing dispatches on
+# node kinds at runtime. Statement closures may return None instead of a Value.
+Closure = Callable[[Scope], Optional[Value]]
+
+
+def compile_stat(stat: Node) -> Closure:
+	kind = type(stat)
+	if kind is Var:
+		name = stat.name
+		value = compile_expr(stat.value)
+		if stat.is_const:
+			return lambda scope: scope.new(name, value(scope), True)
+		return lambda scope: scope.new(name, value(scope))
+	elif kind is Assign:
+		name = stat.name
+		value = compile_expr(stat.value)
+		depth = stat.depth
+		if depth is None:
+			return lambda scope: scope.assign(name, value(scope))
+		return lambda scope: scope.assign_at(depth, name, value(scope))
+	elif kind is Return:
+		value = compile_expr(stat.value)
+		def _return(scope: Scope) -> Value:
+			scope.returned_value = value(scope)
+			return scope.returned_value
+		return _return
+	return compile_expr(stat)
+
+
+def compile_expr(expr: Node, make_scope: bool = True) -> Closure:
+	if not make_scope and type(expr) is Block:
+		return compile_block(expr, make_scope = False)
+	return COMPILERS[type(expr)](expr)
+
+
+def compile_block(block: Block, make_scope: bool = True) -> Closure:
+	statements: List[Closure] = []
+	result: Optional[Closure] = None
+	for statement in block.body:
+		if type(statement) is Return:
+			result = compile_expr(statement.value)
+			# Anything after a return is unreachable
+			break
+		statements.append(compile_stat(statement))
+	is_pure = block.is_pure
+
+	def _block(scope: Scope) -> Value:
+		if make_scope:
+			scope = scope.make_child_scope(is_pure)
+		for statement in statements:
+			statement(scope)
+		return NONE if result is None else result(scope)
+	return _block
+
+
+def compile_function(func: Func) -> Callable[[Scope], Value]:
+	body = compile_stat(func.body)
+	if type(func.body) is Var or type(func.body) is Assign:
+		def _body(scope: Scope) -> Value:
+			body(scope)
+			return NONE
+		return _body
+	return body
+
+
+def _literal(expr: Literal) -> Closure:
+	value = box(expr.value)
+	return lambda scope: value
+
+
+def _string(expr: String) -> Closure:
+	value = string_literal(expr.text)
+	return lambda scope: value
+
+
+def _template(expr: Template) -> Closure:
+	strings = expr.strings
+	parts = [compile_expr(part) for part in expr.exprs]
+	return lambda scope: format_template(strings, [part(scope) for part in parts])
+
+
+def _name(expr: Name) -> Closure:
+	name = expr.name
+	depth = expr.depth
+	if depth is None:
+		return lambda scope: scope.get_global(name)
+	elif depth == 0:
+		return lambda scope: scope.scope[name] if name in scope.scope else scope.get(name)
+	return lambda scope: scope.get_at(depth, name)
+
+
+def _member(expr: Member) -> Closure:
+	target = compile_expr(expr.target)
+	get = MemberCache(expr.name).get
+	return lambda scope: get(target(scope))
+
+
+def _unary_op(expr: UnaryOp) -> Closure:
+	if expr.op == 'not':
+		operand = compile_expr(expr.operand)
+		return lambda scope: FALSE if operand(scope).value else TRUE
+	depth, name, op = expr.operand.depth, expr.operand.name, expr.op
+	return lambda scope: scope.step(depth, name, op)
+
+
+def _bin_op(expr: BinOp) -> Closure:
+	left = compile_expr(expr.left)
+	right = compile_expr(expr.right)
+	op = expr.op
+	return lambda scope: getattr(left(scope), op)(right(scope))
+
+
+def _logical(expr: Logical) -> Closure:
+	left = compile_expr(expr.left)
+	right = compile_expr(expr.right)
+	if expr.op == 'and':
+		def _and(scope: Scope) -> Value:
+			value = left(scope)
+			return right(scope) if value.value else value
+		return _and
+
+	def _or(scope: Scope) -> Value:
+		value = left(scope)
+		return value if value.value else right(scope)
+	return _or
+
+
+def _func(expr: Func) -> Closure:
+	args = expr.args
+	is_pure = expr.is_pure
+	body = Function(compile_function(expr))
+	return lambda scope: FuncValue(args, is_pure, body)
+
+
+def _invoke(expr: Invoke) -> Closure:
+	target = compile_expr(expr.func)
+	args = [compile_expr(arg) for arg in expr.args]
+	if expr.tail:
+		return lambda scope: scope.tail_invoke(target(scope), [arg(scope) for arg in args])
+	return lambda scope: scope.invoke(target(scope), [arg(scope) for arg in args])
+
+
+def _if(expr: If) -> Closure:
+	cond = compile_expr(expr.cond)
+	then = compile_expr(expr.then, make_scope = False)
+	if expr.else_ is None:
+		return lambda scope: then(scope) if cond(scope).is_truthy() else NONE
+	else_ = compile_expr(expr.else_, make_scope = False)
+	return lambda scope: then(scope) if cond(scope).is_truthy() else else_(scope)
+
+
+def _for(expr: For) -> Closure:
+	init = compile_expr(expr.init)
+	cond = compile_expr(expr.cond)
+	step = compile_expr(expr.step)
+	body = expr.statements()
+	statements: List[Closure] = []
+	result: Optional[Closure] = None
+	for statement in body:
+		if type(statement) is Return:
+			result = compile_expr(statement.value)
+			break
+		statements.append(compile_stat(statement))
+	is_pure = expr.is_pure()
+	reset = bool(declarations(body))
+
+	def _loop(scope: Scope) -> Value:
+		scope = scope.make_child_scope(False)
+		body = scope
+		init(scope)
+		while cond(scope).is_truthy():
+			if is_pure:
+				body = scope.make_child_scope(True)
+			elif reset:
+				scope.reset()
+			for statement in statements:
+				statement(body)
+			if result is not None:
+				return result(body)
+			step(scope)
+		return NONE
+	return _loop
+
+
+# Node type -> closure compiler, used by `compile_expr`
+COMPILERS: Dict[type, Callable[[Any], Closure]] = {
+	Literal: _literal,
+	String: _string,
+	Template: _template,
+	Name: _name,
+	Member: _member,
+	UnaryOp: _unary_op,
+	BinOp: _bin_op,
+	Logical: _logical,
+	Func: _func,
+	Invoke: _invoke,
+	Block: compile_block,
+	If: _if,
+	For: _for,
+}
+
+
+def execute(program: Program, scope: Scope):
+	for statement in [compile_stat(statement) for statement in program.body]:
+		statement(scope)
@@ -0,0 +1,71 @@
+import gc
+from typing import Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar('T')
+
+
+# Bookkeeping for Python's cyclic garbage collector. Runtime values and scopes never form reference
+# cycles on their own, so refcounting frees them as soon as they become unreachable. The counters
+# show what a run still leaves to the cyclic collector, and freezing moves everything alive after
+# startup (interpreter, stdlib and ANTLR modules, builtins) out of the collector's way so that full
+# collections only scan what the program itself allocates.
+
+# Set to True (`--gc-freeze`) to `gc.freeze()` once startup is done
+freeze = False
+
+# `gc.get_stats()` when the program started running, None until then
+baseline: Optional[List[Dict[str, int]]] = None
+
+# Collections run for garbage left by parsing imports, not counted as the program's
+excluded = { 'collections': 0, 'collected': 0, 'uncollectable': 0 }
+# Cyclic garbage those collections found
+parser_garbage = 0
+
+
+# Called right before a program starts running. Only the first call (the main file) counts, imports
+# run later.
+def started():
+	global baseline
+	if baseline is not None:
+		return
+	# Startup garbage, like the ANTLR parse tree, is not the program's doing
+	gc.collect()
+	if freeze:
+		gc.freeze()
+	baseline = gc.get_stats()
+
+
+# Parses a file with `parse`. Once the program is running (imports parsed on a cache miss), the
+# garbage the ANTLR parse tree leaves behind is collected straight away and kept out of the
+# program's counters. What the program left before is collected first and counts as collected by
+# the program, but neither collection counts as one of the program's.
+def parsing(parse: Callable[[], T]) -> T:
+	global parser_garbage
+	if baseline is None:
+		return parse()
+	first = gc.get_stats()
+	gc.collect()
+	before = gc.get_stats()
+	result = parse()
+	parser_garbage += gc.collect()
+	after = gc.get_stats()
+	# Collections that ran while parsing only found the parser's garbage
+	for now, then in zip(after, before):
+		excluded['collected'] += now['collected'] - then['collected']
+		excluded['uncollectable'] += now['uncollectable'] - then['uncollectable']
+	excluded['collections'] += sum(now['collections'] - then['collections'] for now, then in zip(after, first))
+	return result
+
+
+def stats() -> Dict[str, int]:
+	before = baseline or [{ 'collections': 0, 'collected': 0, 'uncollectable': 0 }] * len(gc.get_stats())
+	after = gc.get_stats()
+	counters = {
+		key: sum(now[key] - then[key] for now, then in zip(after, before)) - excluded[key]
+		for key in ('collections', 'collected', 'uncollectable')
+	}
+	# Cyclic garbage that no collection got to yet
+	counters['pending'] = gc.collect()
+	counters['parser'] = parser_garbage
+	counters['frozen'] = gc.get_freeze_count()
+	return counters
@@ -0,0 +1,65 @@
+import ctypes
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from prototype.interpreter import NONE, Scope, Value, box
+
+
+# C type name -> (ctypes type, converter from the Python value inside a Value to the argument, None to
+# pass it as is). Numbers and pointers are checked and converted by ctypes itself through `argtypes`.
+ARGUMENT_TYPES: Dict[str, Tuple[Any, Optional[Callable[[Any], Any]]]] = {
+	'c_char_p': (ctypes.c_char_p, str.encode),
+	'c_int': (ctypes.c_int, None),
+	'c_long': (ctypes.c_long, None),
+	'c_size_t': (ctypes.c_size_t, None),
+	'c_double': (ctypes.c_double, None),
+	'c_void_p': (ctypes.c_void_p, None),
+}
+
+# C type name -> (ctypes type, converter from the returned Python value to a Value)
+RESULT_TYPES: Dict[str, Tuple[Any, Callable[[Any], Value]]] = {
+	'void': (None, lambda result: NONE),
+	'c_char_p': (ctypes.c_char_p, lambda result: box(None if result is None else result.decode())),
+	'c_int': (ctypes.c_int, box),
+	'c_long': (ctypes.c_long, box),
+	'c_size_t': (ctypes.c_size_t, box),
+	'c_double': (ctypes.c_double, box),
+	'c_void_p': (ctypes.c_void_p, box),
+}
+
+
+def c_type(types: Dict[str, Any], name: Any) -> Any:
+	if name not in types:
+		raise RuntimeError(f"Unsupported C type: {name} (expected one of: {', '.join(types)})")
+	return types[name]
+
+
+# The callable of a wrapped native function. Types are looked up once, when wrapping: the symbol
+# gets its `argtypes` and `restype`, and a call only converts what ctypes cannot take as is.
+class Signature:
+	__slots__ = ('func', 'args', 'result')
+	func: Callable[..., Any]
+	args: List[Tuple[str, Optional[Callable[[Any], Any]]]]
+	result: Callable[[Any], Value]
+
+	def __init__(self, func: Callable[..., Any], arg_types: Dict[str, str], result_type: str):
+		argtypes = []
+		self.args = []
+		for name, type_name in arg_types.items():
+			ctype, convert = c_type(ARGUMENT_TYPES, type_name)
+			argtypes.append(ctype)
+			self.args.append((name, convert))
+		restype, self.result = c_type(RESULT_TYPES, result_type)
+
+		if isinstance(func, ctypes._CFuncPtr):
+			# A copy of the symbol, the library hands out the same one to everything asking for it
+			func = ctypes.cast(func, type(func))
+			func.argtypes = argtypes
+			func.restype = restype
+		self.func = func
+
+	def __call__(self, scope: Scope) -> Value:
+		values = []
+		for name, convert in self.args:
+			value = scope.get(name).value
+			values.append(value if convert is None else convert(value))
+		return self.result(self.func(*values))
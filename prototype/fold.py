@@ -0,0 +1,245 @@
+import copy
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from prototype.interpreter import Value, format_template
+from prototype.nodes import Assign, BinOp, Block, For, Func, If, Invoke, Literal, Logical, Member, Name, Node, Program, Return, String, Template, UnaryOp, Var
+from prototype.resolve import declarations
+
+
+# Pure builtins that can run at load time on constant arguments. These have to match the builtins
+# set up in `prototype.__main__.run`.
+FOLDABLE_BUILTINS: Dict[str, Callable[..., Any]] = {
+	'str': lambda something: str(something),
+}
+
+# Operators not worth folding: `is` compares boxes, which depend on how each value was made
+UNFOLDABLE_OPS = { 'is_' }
+
+
+class Region:
+	__slots__ = ('declared', 'known', 'conditional')
+
+	def __init__(self, declared: Iterable[str], known: Optional[Dict[str, Node]] = None):
+		# Names this scope may declare, like in `prototype.resolve`
+		self.declared = set(declared)
+		# `const`s already declared unconditionally in this scope whose value is known at load time
+		self.known = known or {}
+		# Greater than 0 while folding code that may not run, like `if` branches
+		self.conditional = 0
+
+
+# Folds constant expressions at load time: operators on literals, `if`s and `and`/`or`s with constant
+# conditions, `const` references with literal values and calls to pure functions (foldable builtins,
+# or `const` pure functions of the same file) whose arguments are all constants.
+#
+# Functions run in a child of their caller's scope, so only names that provably resolve within the
+# code being folded are substituted. This runs before `prototype.resolve`.
+def fold(program: Program) -> Program:
+	Folder().region(program.body, [])
+	return program
+
+
+def constant(node: Node) -> Optional[Literal]:
+	if type(node) is Literal:
+		return node
+	elif type(node) is String:
+		return Literal(node.text)
+	return None
+
+
+class Folder:
+	scopes: List[Region]
+	# How many functions deep the folder is, builtins can only be trusted outside of functions
+	functions: int
+	# True while partially evaluating a call, which is not allowed to nest
+	inlining: bool
+
+	def __init__(self):
+		self.scopes = []
+		self.functions = 0
+		self.inlining = False
+
+	def region(self, body: List[Node], outer: List[Region], args: Iterable[str] = (), known: Optional[Dict[str, Node]] = None):
+		saved = self.scopes
+		self.scopes = outer + [Region(declarations(body) | set(args), known)]
+		body[:] = [self.stat(statement) for statement in body]
+		self.scopes = saved
+
+	def lookup(self, name: str) -> Optional[Region]:
+		for region in reversed(self.scopes):
+			if name in region.declared:
+				return region
+		return None
+
+	def known(self, name: str) -> Optional[Node]:
+		region = self.lookup(name)
+		return None if region is None else region.known.get(name)
+
+	def stat(self, stat: Node) -> Node:
+		kind = type(stat)
+		if kind is Var:
+			stat.value = self.expr(stat.value)
+			region = self.scopes[-1]
+			if stat.is_const and not region.conditional:
+				value = constant(stat.value)
+				if value is not None:
+					region.known[stat.name] = value
+				elif type(stat.value) is Func and stat.value.is_pure:
+					region.known[stat.name] = stat.value
+			return stat
+		elif kind is Assign or kind is Return:
+			stat.value = self.expr(stat.value)
+			return stat
+		return self.expr(stat)
+
+	def expr(self, expr: Node) -> Node:
+		kind = type(expr)
+		if kind is Name:
+			value = self.known(expr.name)
+			return Literal(value.value) if type(value) is Literal else expr
+		elif kind is Member:
+			expr.target = self.expr(expr.target)
+		elif kind is Template:
+			expr.exprs = [self.expr(part) for part in expr.exprs]
+			parts = [constant(part) for part in expr.exprs]
+			if all(part is not None for part in parts):
+				return String(format_template(expr.strings, [Value(part.value) for part in parts]).value)
+		elif kind is UnaryOp:
+			# `++` and `--` rebind their operand, so it has to stay a variable
+			if expr.op != 'not':
+				return expr
+			expr.operand = self.expr(expr.operand)
+			operand = constant(expr.operand)
+			if operand is not None:
+				return Literal(not operand.value)
+		elif kind is BinOp:
+			if expr.op in UNFOLDABLE_OPS:
+				return expr
+			expr.left = self.expr(expr.left)
+			expr.right = self.expr(expr.right)
+			left, right = constant(expr.left), constant(expr.right)
+			if left is not None and right is not None:
+				try:
+					return Literal(getattr(Value(left.value), expr.op)(Value(right.value)).value)
+				except Exception:
+					# Errors such as dividing by zero are left for runtime
+					pass
+		elif kind is Logical:
+			expr.left = self.expr(expr.left)
+			expr.right = self.expr(expr.right)
+			left = constant(expr.left)
+			if left is not None:
+				if expr.op == 'and':
+					return expr.right if left.value else left
+				return left if left.value else expr.right
+		elif kind is Func:
+			body = [expr.body]
+			self.functions += 1
+			self.region(body, [], expr.args)
+			self.functions -= 1
+			expr.body = body[0]
+		elif kind is Invoke:
+			if type(expr.func) is not Name:
+				expr.func = self.expr(expr.func)
+			expr.args = [self.expr(arg) for arg in expr.args]
+			folded = self.call(expr)
+			if folded is not None:
+				return folded
+		elif kind is Block:
+			self.region(expr.body, self.scopes)
+			return self.block_value(expr) or expr
+		elif kind is If:
+			return self.if_(expr)
+		elif kind is For:
+			return self.for_(expr)
+		return expr
+
+	# A block without side effects collapses into the value it returns
+	def block_value(self, block: Block) -> Optional[Literal]:
+		names = set()
+		for statement in block.body:
+			if type(statement) is Return:
+				return constant(statement.value)
+			elif type(statement) is not Var or not statement.is_const or constant(statement.value) is None or statement.name in names:
+				return None
+			names.add(statement.name)
+		return Literal(None)
+
+	def if_(self, expr: If) -> Node:
+		expr.cond = self.expr(expr.cond)
+		region = self.scopes[-1]
+		region.conditional += 1
+		for attr in ('then', 'else_'):
+			branch = getattr(expr, attr)
+			# Branch blocks run in the enclosing scope
+			if type(branch) is Block:
+				branch.body[:] = [self.stat(statement) for statement in branch.body]
+			elif branch is not None:
+				setattr(expr, attr, self.expr(branch))
+		region.conditional -= 1
+
+		cond = constant(expr.cond)
+		if cond is None:
+			return expr
+		branch = expr.then if cond.value is True else expr.else_
+		if branch is None:
+			return Literal(None)
+		elif type(branch) is not Block:
+			return branch
+		# A branch block only behaves like a normal block when it declares nothing
+		elif not branch.is_pure and not declarations(branch.body):
+			return self.block_value(branch) or branch
+		return If(Literal(True), branch, None)
+
+	def for_(self, expr: For) -> Node:
+		saved = self.scopes
+		body = expr.statements()
+		# The body's declarations are redone every iteration, if there is one at all
+		region = Region(declarations(body))
+		region.conditional = 1
+		self.scopes = saved + [region]
+		expr.init = self.expr(expr.init)
+		expr.cond = self.expr(expr.cond)
+		expr.step = self.expr(expr.step)
+		body[:] = [self.stat(statement) for statement in body]
+		if type(expr.body) is not Block:
+			expr.body = body[0]
+		self.scopes = saved
+
+		# A loop that never runs and has nothing to initialise
+		cond = constant(expr.cond)
+		if cond is not None and cond.value is not True and constant(expr.init) is not None:
+			return Literal(None)
+		return expr
+
+	def call(self, expr: Invoke) -> Optional[Node]:
+		if type(expr.func) is not Name:
+			return None
+		args = [constant(arg) for arg in expr.args]
+		if any(arg is None for arg in args):
+			return None
+		name = expr.func.name
+
+		# Builtins, as long as nothing can shadow them
+		if self.lookup(name) is None:
+			if self.functions or name not in FOLDABLE_BUILTINS:
+				return None
+			try:
+				return Literal(FOLDABLE_BUILTINS[name](*[arg.value for arg in args]))
+			except Exception:
+				return None
+
+		# `const` pure functions: fold a copy of the body with the arguments filled in
+		func = self.known(name)
+		if type(func) is not Func or len(func.args) != len(args) or self.inlining:
+			return None
+		body = [copy.deepcopy(func.body)]
+		saved = self.functions
+		self.inlining = True
+		self.functions += 1
+		try:
+			self.region(body, [], func.args, dict(zip(func.args, args)))
+		finally:
+			self.inlining = False
+			self.functions = saved
+		return constant(body[0])
@@ -0,0 +1,63 @@
+import weakref
+from typing import Any, Callable, Dict
+
+
+# Per-site cache for `a.b`. Each site remembers, per receiver type, a getter specialised for that type
+# and member name (see `Value.member_getter`), so repeated accesses skip the generic `dot` lookup.
+# After `LIMIT` different types a site is megamorphic and just calls `dot`.
+class MemberCache:
+	__slots__ = ('name', 'getters', 'hits', 'misses', '__weakref__')
+	name: str
+	getters: Dict[type, Callable[[Any], Any]]
+	hits: int
+	misses: int
+
+	LIMIT = 4
+
+	# Every live site, and the totals of the ones already collected, for `stats`
+	sites: 'weakref.WeakSet[MemberCache]' = weakref.WeakSet()
+	retired = { 'sites': 0, 'hits': 0, 'misses': 0, 'megamorphic': 0 }
+
+	def __init__(self, name: str):
+		self.name = name
+		self.getters = {}
+		self.hits = 0
+		self.misses = 0
+		MemberCache.sites.add(self)
+
+	def get(self, receiver: Any) -> Any:
+		getter = self.getters.get(type(receiver))
+		if getter is not None:
+			self.hits += 1
+			return getter(receiver)
+
+		self.misses += 1
+		if len(self.getters) >= MemberCache.LIMIT:
+			return receiver.dot(self.name)
+		getter = type(receiver).member_getter(self.name)
+		self.getters[type(receiver)] = getter
+		return getter(receiver)
+
+	def __del__(self):
+		MemberCache.retired['sites'] += 1
+		MemberCache.retired['hits'] += self.hits
+		MemberCache.retired['misses'] += self.misses
+		MemberCache.retired['megamorphic'] += len(self.getters) >= MemberCache.LIMIT
+
+	def __repr__(self) -> str:
+		return f'<member {self.name}>'
+
+	# Pickling (and deep copying) starts over with an empty cache
+	def __reduce__(self):
+		return (MemberCache, (self.name,))
+
+	@staticmethod
+	def stats() -> Dict[str, int]:
+		sites = list(MemberCache.sites)
+		retired = MemberCache.retired
+		return {
+			'sites': retired['sites'] + len(sites),
+			'hits': retired['hits'] + sum(site.hits for site in sites),
+			'misses': retired['misses'] + sum(site.misses for site in sites),
+			'megamorphic': retired['megamorphic'] + sum(1 for site in sites if len(site.getters) >= MemberCache.LIMIT),
+		}
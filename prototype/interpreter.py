@@ -1,28 +1,43 @@
-from typing import Any, Callable, Dict, List, Optional
-from antlr4.tree.Tree import TerminalNodeImpl
-from prototype.syntax.LanguageParser import LanguageParser
-
-
-ESCAPES = {
-	"\\\"": "\"",
-	"\\'": "'",
-	"\\r": "\r",
-	"\\n": "\n",
-	"\\t": "\t",
-	"\\f": "\f",
-}
+import itertools
+import sys
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+from prototype.inline_cache import MemberCache
+from prototype.nodes import Assign, BinOp, Block, For, Func, If, Invoke, Literal, Logical, Member, Name, Node, Program, Return, String, Template, UnaryOp, Var
 
 
+# Values never change once made (`++` rebinds the variable instead), so the common ones are shared,
+# see `box`.
 class Value:
-	members: Dict[str, 'Value']
+	__slots__ = ('value', '_members')
 	value: Any
+	_members: Optional[Dict[str, 'Value']]
+
+	# Builtin methods shared by every value of the class, see `Method`
+	methods: Dict[str, 'Method'] = {}
 
 	def __init__(self, value: Any):
 		self.value = value
-		self.members = { }
+		self._members = None
+
+	# Created on first use, most values never have members
+	@property
+	def members(self) -> Dict[str, 'Value']:
+		if self._members is None:
+			self._members = {}
+		return self._members
 
 	def evaluate(self) -> 'Value':
-		return Value(self.value)
+		return self
+
+	def __repr__(self) -> str:
+		return f'{type(self).__name__}({self.value!r})'
+
+	# Pickled by value (for `par_map` results), so unpickled plain values share boxes again
+	def __reduce__(self):
+		if type(self) is Value:
+			return (box, (self.value,))
+		return (type(self), (self.value,))
 
 	def is_truthy(self) -> bool:
 		return self.value is True
@@ -31,32 +46,82 @@ class Value:
 		return self.value.__dict__[scope.get('name').value]
 
 	# Operators
-	def add(self, other: 'Value')  -> 'Value': return Value(self.value + other.value)
-	def sub(self, other: 'Value')  -> 'Value': return Value(self.value - other.value)
-	def mul(self, other: 'Value')  -> 'Value': return Value(self.value * other.value)
-	def div(self, other: 'Value')  -> 'Value': return Value(self.value / other.value)
-	def mod(self, other: 'Value')  -> 'Value': return Value(self.value % other.value)
-	def eq(self, other: 'Value')   -> 'Value': return Value(self.value == other.value)
-	def gt(self, other: 'Value')   -> 'Value': return Value(self.value > other.value)
-	def gteq(self, other: 'Value') -> 'Value': return Value(self.value >= other.value)
-	def lt(self, other: 'Value')   -> 'Value': return Value(self.value < other.value)
-	def lteq(self, other: 'Value') -> 'Value': return Value(self.value <= other.value)
-	def is_(self, other: 'Value')  -> 'Value': return Value(other is self)
-	def in_(self, other: 'Value')  -> 'Value': return Value(other.value in self)
+	def add(self, other: 'Value')  -> 'Value': return box(self.value + other.value)
+	def sub(self, other: 'Value')  -> 'Value': return box(self.value - other.value)
+	def mul(self, other: 'Value')  -> 'Value': return box(self.value * other.value)
+	def div(self, other: 'Value')  -> 'Value': return box(self.value / other.value)
+	def mod(self, other: 'Value')  -> 'Value': return box(self.value % other.value)
+	def eq(self, other: 'Value')   -> 'Value': return TRUE if self.value == other.value else FALSE
+	def neq(self, other: 'Value')  -> 'Value': return TRUE if self.value != other.value else FALSE
+	def gt(self, other: 'Value')   -> 'Value': return TRUE if self.value > other.value else FALSE
+	def gteq(self, other: 'Value') -> 'Value': return TRUE if self.value >= other.value else FALSE
+	def lt(self, other: 'Value')   -> 'Value': return TRUE if self.value < other.value else FALSE
+	def lteq(self, other: 'Value') -> 'Value': return TRUE if self.value <= other.value else FALSE
+	def is_(self, other: 'Value')  -> 'Value': return TRUE if other is self else FALSE
+	def in_(self, other: 'Value')  -> 'Value':
+		# Lists hold boxes, the items are compared by what is inside them
+		if type(other) is ListValue:
+			value = self.value
+			return TRUE if any(value == item.value for item in other.value) else FALSE
+		return TRUE if self.value in other.value else FALSE
 
 	def inc(self) -> 'Value':
-		self.value += 1
-		return self.value
+		return box(self.value + 1)
 
 	def dec(self) -> 'Value':
-		self.value -= 1
-		return self.value
+		return box(self.value - 1)
 
 	def dot(self, id_: str) -> 'Value':
-		if id_ in self.members:
-			return self.members[id_]
+		members = self._members
+		if members is not None and id_ in members:
+			return members[id_]
+		method = self.methods.get(id_)
+		if method is not None:
+			return method.bind(self)
 		raise RuntimeError(f"Unknown variable: {id_}")
 
+	# Returns a function doing `value.dot(id_)` for values of this class, used by inline caches
+	@classmethod
+	def member_getter(cls, id_: str) -> Callable[['Value'], 'Value']:
+		method = cls.methods.get(id_)
+		if method is not None:
+			bind = method.bind
+			def get_method(value: Value) -> Value:
+				members = value._members
+				return members[id_] if members is not None and id_ in members else bind(value)
+			return get_method
+		def get(value: Value) -> Value:
+			members = value._members
+			return members[id_] if members is not None and id_ in members else value.dot(id_)
+		return get
+
+
+NONE = Value(None)
+TRUE = Value(True)
+FALSE = Value(False)
+SMALL_INTS = [Value(i) for i in range(-5, 257)]
+
+# Python type -> Value class boxing it, for types other than the plain ones that operators can
+# produce, registered by the modules adding them (like `prototype.arrays`)
+BOXES: Dict[type, Callable[[Any], Value]] = {}
+
+
+# Boxes a Python value, sharing the boxes for None, booleans and small ints
+def box(value: Any) -> Value:
+	if value is None:
+		return NONE
+	elif value is True:
+		return TRUE
+	elif value is False:
+		return FALSE
+	kind = type(value)
+	if kind is int:
+		if -5 <= value <= 256:
+			return SMALL_INTS[value + 5]
+	elif kind in BOXES:
+		return BOXES[kind](value)
+	return Value(value)
+
 
 class NativeValue(Value):
 	def __init__(self, value: Any):
@@ -67,8 +132,13 @@ class NativeValue(Value):
 			return self.__dict__[id_]
 		raise RuntimeError(f"Unknown native variable: {id_}")
 
+	@classmethod
+	def member_getter(cls, id_: str) -> Callable[[Value], Value]:
+		return lambda value: value.dot(id_)
+
 
 class FuncValue(Value):
+	__slots__ = ('args', 'is_pure')
 	args: list[str]
 	is_pure: bool
 
@@ -79,25 +149,114 @@ class FuncValue(Value):
 
 	def invoke(self, scope: 'Scope', args: list['Value']) -> 'Value':
 		child_scope = scope.make_child_scope(self.is_pure)
-		for name, value in zip(self.args, args):
-			child_scope.new(name, value)
+		bind(child_scope, self, args)
 		return self.value(child_scope)
 
 
+# A call in tail position (see `prototype.resolve.mark_tail_calls`) to a `Function`. It is returned
+# instead of made, and the `Function` running the caller makes it once the caller is done, so tail
+# recursion does not grow the Python stack.
+class TailCall:
+	__slots__ = ('func', 'args', 'scope')
+	func: FuncValue
+	args: List[Value]
+	scope: 'Scope'
+
+	def __init__(self, func: FuncValue, args: List[Value], scope: 'Scope'):
+		self.func = func
+		self.args = args
+		self.scope = scope
+
+
+# The callable of a function defined by a program, for every backend but the VM. `body` runs the
+# function in the scope it is given and returns either the result or a TailCall.
+class Function:
+	__slots__ = ('body',)
+	body: Callable[['Scope'], Any]
+
+	def __init__(self, body: Callable[['Scope'], Any]):
+		self.body = body
+
+	def __call__(self, scope: 'Scope') -> Value:
+		result = self.body(scope)
+		while type(result) is TailCall:
+			scope = tail_scope(scope, result.scope, result.func, result.args)
+			result = result.func.value.body(scope)
+		return result
+
+
+# The scope for a tail call made from `caller`, somewhere inside the call whose own scope is
+# `finished`. The new call is a child of `caller` like any other, unless nothing but arguments is
+# left between the two and the new call's arguments shadow all of them. Then nothing can see
+# `finished` anymore, and it is reused so that tail recursion runs in constant memory. An impure
+# function is never run in place of a pure scope: as a child of `caller` it could not assign past
+# that scope either.
+def tail_scope(finished: 'Scope', caller: 'Scope', func: FuncValue, args: List[Value]) -> 'Scope':
+	scope = caller
+	pure = caller.pure
+	while scope is not finished and not scope.scope:
+		scope = scope.parent
+		pure = pure or scope.pure
+	bound = func.args[:len(args)]
+	if scope is finished and (func.is_pure or not pure) and all(name in bound for name in finished.scope):
+		finished.reset()
+		finished.pure = func.is_pure
+	else:
+		finished = caller.make_child_scope(func.is_pure)
+	bind(finished, func, args)
+	return finished
+
+
+# A builtin method in a class's `methods` table. The function takes the receiver and the scope of the
+# call, and is only bound to a receiver when the member is accessed, so values do not carry their own
+# copies of every method.
+class Method:
+	__slots__ = ('args', 'is_pure', 'func')
+	args: list[str]
+	is_pure: bool
+	func: Callable[[Any, 'Scope'], Value]
+
+	def __init__(self, args: list[str], is_pure: bool, func: Callable[[Any, 'Scope'], Value]):
+		self.args = args
+		self.is_pure = is_pure
+		self.func = func
+
+	def bind(self, receiver: Value) -> FuncValue:
+		return FuncValue(self.args, self.is_pure, partial(self.func, receiver))
+
+
 class TableValue(Value):
+	__slots__ = ('shared',)
+	# True while the dict may also belong to another table, see `bind`
+	shared: bool
+
 	def __init__(self, value: Optional[Dict[str, Value]] = None):
 		super().__init__(value or {})
-		self.members['get'] = FuncValue(['index'], True, lambda scope: self.get(scope.get('index').value))
-		self.members['put'] = FuncValue(['index', 'value'], True, lambda scope: self.put(scope.get('index').value, scope.get('value')))
-		def _put_ip(scope: Scope) -> TableValue:
-			self.put(scope.get('index').value, scope.get('value'))
-			return self
-		self.members['put_ip'] = FuncValue(['index', 'value'], True, _put_ip)
+		self.shared = False
+
+	# A table with the same entries for a pure function to use. Both tables are marked shared, so
+	# whichever changes first copies the dict.
+	def share(self) -> 'TableValue':
+		copy_on_write['shared'] += 1
+		self.shared = True
+		table = TableValue(self.value)
+		table.shared = True
+		return table
+
+	# Makes the dict this table's own before changing it. It is only copied while something else
+	# still holds it, see `still_shared`.
+	def own(self):
+		if self.shared:
+			if still_shared(self.value):
+				copy_on_write['copies'] += 1
+				self.value = dict(self.value)
+			self.shared = False
 
 	def get(self, index: str) -> Value:
 		return self.value[index]
 
 	def put(self, index: str, value: Value):
+		self.own()
 		self.value[index] = value
 
 	def dot(self, id_: str) -> Value:
@@ -105,196 +264,596 @@ class TableValue(Value):
 			return self.value[id_]
 		return super().dot(id_)
 
+	@classmethod
+	def member_getter(cls, id_: str) -> Callable[[Value], Value]:
+		method = cls.methods.get(id_)
+		if method is not None:
+			bind = method.bind
+			def get_method(table: TableValue) -> Value:
+				entries = table.value
+				return entries[id_] if id_ in entries else bind(table)
+			return get_method
+		def get(table: TableValue) -> Value:
+			entries = table.value
+			return entries[id_] if id_ in entries else table.dot(id_)
+		return get
+
+	# Methods
+	def _get(self, scope: 'Scope') -> Value:
+		return self.get(scope.get('index').value)
+
+	def _put(self, scope: 'Scope') -> Value:
+		self.put(scope.get('index').value, scope.get('value'))
+		return NONE
+
+	def _put_ip(self, scope: 'Scope') -> 'TableValue':
+		self.put(scope.get('index').value, scope.get('value'))
+		return self
+
+	# The keys as of when the sequence is iterated, entries added meanwhile are not visited
+	def _keys(self, scope: 'Scope') -> 'SeqValue':
+		entries = self.value
+		return SeqValue(lambda scope: map(Value, tuple(entries)))
+
+	def _values(self, scope: 'Scope') -> 'SeqValue':
+		entries = self.value
+		return SeqValue(lambda scope: iter(tuple(entries.values())))
+
+
+TableValue.methods = {
+	'get': Method(['index'], True, TableValue._get),
+	'put': Method(['index', 'value'], True, TableValue._put),
+	'put_ip': Method(['index', 'value'], True, TableValue._put_ip),
+	'keys': Method([], True, TableValue._keys),
+	'values': Method([], True, TableValue._values),
+}
+
 
 class ListValue(Value):
+	__slots__ = ('shared',)
+	# True while the list may also belong to another list value, see `bind`
+	shared: bool
+
 	def __init__(self, value: Optional[List[Value]] = None):
 		super().__init__(value or [])
-		self.members['append'] = FuncValue(['value'], True, lambda scope: self.value.append(scope.get('value')))
-		self.members['prepend'] = FuncValue(['value'], True, lambda scope: self.value.insert(0, scope.get('value')))
-		self.members['insert'] = FuncValue(['index', 'value'], True, lambda scope: self.value.insert(int(scope.get('index').value), scope.get('value')))
-		self.members['pop'] = FuncValue([], True, lambda scope: Value(self.value.pop()))
-		self.members['get'] = FuncValue(['index'], True, lambda scope: Value(self.value[int(scope.get('index').value)]))
-		self.members['count'] = FuncValue([], True, lambda scope: Value(len(self.value)))
-		self.members['for_each'] = FuncValue(['callback'], False, lambda scope: ListValue([scope.get('callback').invoke(scope, [it]) for it in self.value]))
-		def _append_ip(scope):
-			self.value.append(scope.get('value').value)
-			return self
-		self.members['append_ip'] = FuncValue(['value'], True, _append_ip)
+		self.shared = False
+
+	# A list with the same items for a pure function to use. Both lists are marked shared, so
+	# whichever changes first copies the items.
+	def share(self) -> 'ListValue':
+		copy_on_write['shared'] += 1
+		self.shared = True
+		items = ListValue(self.value)
+		items.shared = True
+		return items
+
+	# Makes the list this value's own before changing it. It is only copied while something else
+	# still holds it, see `still_shared`.
+	def own(self):
+		if self.shared:
+			if still_shared(self.value):
+				copy_on_write['copies'] += 1
+				self.value = list(self.value)
+			self.shared = False
+
+	# Methods
+	def _append(self, scope: 'Scope') -> Value:
+		self.own()
+		self.value.append(scope.get('value'))
+		return NONE
+
+	def _prepend(self, scope: 'Scope') -> Value:
+		self.own()
+		self.value.insert(0, scope.get('value'))
+		return NONE
+
+	def _insert(self, scope: 'Scope') -> Value:
+		self.own()
+		self.value.insert(int(scope.get('index').value), scope.get('value'))
+		return NONE
+
+	def _pop(self, scope: 'Scope') -> Value:
+		self.own()
+		return self.value.pop()
+
+	def _get(self, scope: 'Scope') -> Value:
+		return self.value[int(scope.get('index').value)]
+
+	def _count(self, scope: 'Scope') -> Value:
+		return box(len(self.value))
+
+	def _for_each(self, scope: 'Scope') -> 'ListValue':
+		callback = scope.get('callback')
+		return ListValue([callback.invoke(scope, [it]) for it in self.value])
+
+	def _append_ip(self, scope: 'Scope') -> 'ListValue':
+		self.own()
+		self.value.append(scope.get('value'))
+		return self
+
+	def _seq(self, scope: 'Scope') -> 'SeqValue':
+		items = self.value
+		return SeqValue(lambda scope: iter(items))
+
+
+ListValue.methods = {
+	'append': Method(['value'], True, ListValue._append),
+	'prepend': Method(['value'], True, ListValue._prepend),
+	'insert': Method(['index', 'value'], True, ListValue._insert),
+	'pop': Method([], True, ListValue._pop),
+	'get': Method(['index'], True, ListValue._get),
+	'count': Method([], True, ListValue._count),
+	'for_each': Method(['callback'], False, ListValue._for_each),
+	'append_ip': Method(['value'], True, ListValue._append_ip),
+	'seq': Method([], True, ListValue._seq),
+}
+
+
+# The callables of functions defined by the program, whatever the backend. Backends with their own
+# register them here.
+PROGRAM_FUNCTIONS: Set[type] = { Function }
+
+# How many lists and tables were shared with pure functions, and how many of those were copied
+copy_on_write = { 'shared': 0, 'copies': 0 }
+
+
+# True if the storage of a shared list or table is held by anything but the value about to change
+# it (its slot, plus the reference passed in here). Views are freed by refcounting as soon as the
+# pure function they were made for is done with them, and a caller whose views are all gone can
+# change its storage in place again.
+def still_shared(storage: Any) -> bool:
+	return sys.getrefcount(storage) > 3
+
+
+# Binds the arguments of a call to `func` in the callee's scope. Pure functions of the program get
+# the lists and tables they are passed copy-on-write: they share the caller's items until they first
+# change them, and then change a copy of their own, so a pure function never changes what its caller
+# sees. Lists and tables nested in those are shared as they are.
+def bind(scope: 'Scope', func: FuncValue, args: List[Value]):
+	share = func.is_pure and type(func.value) in PROGRAM_FUNCTIONS
+	for name, value in zip(func.args, args):
+		if share and (type(value) is ListValue or type(value) is TableValue):
+			value = value.share()
+		scope.new(name, value)
+
+
+# A lazy sequence: `value` makes a fresh iterator over the items every time the sequence is iterated,
+# and nothing is computed before then. Callbacks run in the scope of whatever iterates the sequence,
+# like any other call, so sequences hold on to no scope.
+class SeqValue(Value):
+	__slots__ = ()
+
+	def __init__(self, source: Callable[['Scope'], Iterator[Value]]):
+		super().__init__(source)
+
+	# Methods
+	def _map(self, scope: 'Scope') -> 'SeqValue':
+		source, callback = self.value, scope.get('callback')
+		return SeqValue(lambda scope: (callback.invoke(scope, [item]) for item in source(scope)))
+
+	def _filter(self, scope: 'Scope') -> 'SeqValue':
+		source, callback = self.value, scope.get('callback')
+		return SeqValue(lambda scope: (item for item in source(scope) if callback.invoke(scope, [item]).is_truthy()))
+
+	def _take(self, scope: 'Scope') -> 'SeqValue':
+		source, count = self.value, int(scope.get('count').value)
+		return SeqValue(lambda scope: itertools.islice(source(scope), count))
+
+	def _collect(self, scope: 'Scope') -> ListValue:
+		return ListValue(list(self.value(scope)))
+
+	# Runs the callback on every item without keeping the results
+	def _for_each(self, scope: 'Scope') -> Value:
+		callback = scope.get('callback')
+		for item in self.value(scope):
+			callback.invoke(scope, [item])
+		return NONE
+
+
+# `map`, `filter` and `take` only describe work, the callbacks run once `collect` or `for_each` asks
+# for the items
+SeqValue.methods = {
+	'map': Method(['callback'], True, SeqValue._map),
+	'filter': Method(['callback'], True, SeqValue._filter),
+	'take': Method(['count'], True, SeqValue._take),
+	'collect': Method([], False, SeqValue._collect),
+	'for_each': Method(['callback'], False, SeqValue._for_each),
+}
+
+
+# Builtin: range(n) counts from 0 to n - 1, range() counts up without end
+def range_(scope: 'Scope') -> SeqValue:
+	limit = scope.get('n').value if scope.has_own('n') else None
+	return SeqValue(lambda scope: map(box, itertools.count() if limit is None else range(limit)))
+
+
+# A string kept as the pieces it was concatenated from, so that `s = s + piece` in a loop does not
+# copy `s` every time. `value` joins the pieces the first time anything reads it (printing,
+# comparing, splitting, passing it to native code) and keeps the result.
+#
+# Ropes are immutable like any value, but appending to one may extend its list of pieces in place:
+# every rope only looks at its first `count` pieces, so ropes sharing the list keep their own text.
+class RopeValue(Value):
+	__slots__ = ('pieces', 'count', 'text')
+	pieces: List[str]
+	count: int
+	text: Optional[str]
+
+	# Strings at least this long are ropes, shorter ones are cheaper to copy
+	MIN_LENGTH = 256
+
+	def __init__(self, pieces: List[str], count: int):
+		self._members = None
+		self.pieces = pieces
+		self.count = count
+		self.text = None
+
+	@property
+	def value(self) -> str:
+		if self.text is None:
+			self.text = ''.join(self.pieces[:self.count])
+			self.pieces, self.count = [self.text], 1
+		return self.text
+
+	def __reduce__(self):
+		return (box, (self.value,))
+
+	def add(self, other: Value) -> Value:
+		piece = other.value
+		if type(piece) is not str:
+			return box(self.value + piece)
+		pieces = self.pieces
+		if len(pieces) != self.count:
+			# Someone else already appended to the list, this rope gets a list of its own
+			pieces = pieces[:self.count]
+		pieces.append(piece)
+		return RopeValue(pieces, len(pieces))
+
+
+def string_value(text: str) -> Value:
+	return RopeValue([text], 1) if len(text) >= RopeValue.MIN_LENGTH else Value(text)
+
+
+BOXES[str] = string_value
+
+
+# Literal text -> its value, shared by every evaluation of every literal with that text
+STRINGS: Dict[str, Value] = {}
+
+def string_literal(text: str) -> Value:
+	value = STRINGS.get(text)
+	if value is None:
+		value = STRINGS[text] = string_value(text)
+	return value
+
+
+# Fills in a `Template`: values show up like `join` shows them, strings as is and anything else as
+# `str` would
+def format_template(strings: List[str], values: List[Value]) -> Value:
+	parts = [strings[0]]
+	for value, text in zip(values, strings[1:]):
+		value = value.value
+		parts.append(value if type(value) is str else str(value))
+		parts.append(text)
+	return string_value(''.join(parts))
+
+
+# Builtin: string_builder() collects pieces of text with `append` and joins them once with `build`
+class StringBuilderValue(Value):
+	__slots__ = ()
+
+	def __init__(self, value: Optional[List[str]] = None):
+		super().__init__(value or [])
+
+	# Methods
+	def _append(self, scope: 'Scope') -> Value:
+		piece = scope.get('text').value
+		self.value.append(piece if type(piece) is str else str(piece))
+		return NONE
+
+	def _count(self, scope: 'Scope') -> Value:
+		return box(sum(len(piece) for piece in self.value))
+
+	def _build(self, scope: 'Scope') -> Value:
+		text = ''.join(self.value)
+		# The next build starts from the joined text instead of joining everything again
+		self.value[:] = [text]
+		return box(text)
+
+
+StringBuilderValue.methods = {
+	'append': Method(['text'], True, StringBuilderValue._append),
+	'count': Method([], True, StringBuilderValue._count),
+	'build': Method([], True, StringBuilderValue._build),
+}
 
 
 class Scope:
 	parent: Optional['Scope']
+	# The variables of the root scope. Keeping the dict instead of the root scope itself keeps
+	# scopes free of reference cycles.
+	globals: dict[str, Value]
 	scope: dict[str, Value]
 	pure: bool
 	returned_value: Value
 
+	# Every name ever declared in a scope that is not a root. Names outside of this set can only live
+	# in the root scope, which lets `get_global` skip walking the chain.
+	shadowed: Set[str] = set()
+	# How many scopes ever turned `allow_impure_get` off. The fast paths only apply while this is 0.
+	sealed: int = 0
+	# Names declared with `const` in this scope, created on the first one
+	consts: Optional[Set[str]] = None
+
 	def __init__(self, parent: Optional['Scope'] = None, pure: bool = True):
 		self.parent = parent
 		self.scope = {}
+		self.globals = self.scope if parent is None else parent.globals
 		self.pure = pure
-		self.returned_value = Value(None)
-		# Set this to false to make this scope unable to get variables from outside of its scope
-		self.allow_impure_get = True
+		self.returned_value = NONE
+		self._allow_impure_get = True
+
+	# Set this to false to make this scope unable to get variables from outside of its scope
+	@property
+	def allow_impure_get(self) -> bool:
+		return self._allow_impure_get
+
+	@allow_impure_get.setter
+	def allow_impure_get(self, value: bool):
+		if not value:
+			Scope.sealed += 1
+		self._allow_impure_get = value
 
 	def has(self, name: str) -> bool:
-		return name in self.scope or (self.parent is not None and self.parent.has(name))
+		scope = self
+		while scope is not None:
+			if name in scope.scope:
+				return True
+			scope = scope.parent
+		return False
 
 	def has_own(self, name: str) -> bool:
 		return name in self.scope
 
-	def new(self, name: str, value: Value):
-		if self.has_own(name):
+	def new(self, name: str, value: Value, is_const: bool = False):
+		if name in self.scope:
 			raise RuntimeError("Attempted to initialize variable that already exists.")
+		if self.parent is not None:
+			Scope.shadowed.add(name)
+		if is_const:
+			if self.consts is None:
+				self.consts = set()
+			self.consts.add(name)
 		self.scope[name] = value
 
 	def assign(self, name: str, value: Value):
-		if self.has_own(name):
-			self.scope[name] = value
-		elif self.parent is not None and self.parent.has(name) and not self.pure:
-			self.parent.assign(name, value)
-		else:
-			raise RuntimeError("Attempted to assign to a variable that does not exist.")
+		scope = self
+		while name not in scope.scope:
+			if scope.parent is None or scope.pure:
+				raise RuntimeError("Attempted to assign to a variable that does not exist.")
+			scope = scope.parent
+		if scope.consts is not None and name in scope.consts:
+			raise RuntimeError("Attempted to assign to a constant: " + name)
+		scope.scope[name] = value
 
 	def get(self, name: str) -> Value:
-		if self.has_own(name):
-			return self.scope[name]
-		elif self.parent is not None and self.parent.has(name) and (not self.pure or self.allow_impure_get):
-			return self.parent.get(name)
-		else:
-			raise RuntimeError("Attempted to get unknown variable: " + name)
+		scope = self
+		while name not in scope.scope:
+			if scope.parent is None or (scope.pure and not scope._allow_impure_get):
+				raise RuntimeError("Attempted to get unknown variable: " + name)
+			scope = scope.parent
+		return scope.scope[name]
+
+	# `depth` is a hint from `prototype.resolve`: no scope closer than `depth` parents up can hold
+	# `name`. If that scope does not have it either, this falls back to the usual walk.
+	def get_at(self, depth: int, name: str) -> Value:
+		scope = self
+		for _ in range(depth):
+			if scope.pure and not scope._allow_impure_get:
+				raise RuntimeError("Attempted to get unknown variable: " + name)
+			scope = scope.parent
+		if name in scope.scope:
+			return scope.scope[name]
+		return scope.get(name)
+
+	def assign_at(self, depth: int, name: str, value: Value):
+		scope = self
+		for _ in range(depth):
+			if scope.pure:
+				raise RuntimeError("Attempted to assign to a variable that does not exist.")
+			scope = scope.parent
+		scope.assign(name, value)
+
+	# For names that are not declared anywhere in the function using them, typically builtins and
+	# module-level variables.
+	def get_global(self, name: str) -> Value:
+		if Scope.sealed == 0 and name not in Scope.shadowed:
+			scope = self.globals
+			if name in scope:
+				return scope[name]
+		return self.get(name)
+
+	# `name++` and `name--`: values never change, so the variable is rebound to `value.inc()` or
+	# `value.dec()`. `depth` is a hint, see `get_at`.
+	def step(self, depth: Optional[int], name: str, op: str) -> Value:
+		scope = self
+		for _ in range(depth or 0):
+			if scope.pure:
+				raise RuntimeError("Attempted to assign to a variable that does not exist.")
+			scope = scope.parent
+		while name not in scope.scope:
+			if scope.parent is None or scope.pure:
+				raise RuntimeError("Attempted to assign to a variable that does not exist.")
+			scope = scope.parent
+		if scope.consts is not None and name in scope.consts:
+			raise RuntimeError("Attempted to assign to a constant: " + name)
+		# Rebind the slot found above instead of looking the variable up twice
+		variables = scope.scope
+		value = variables[name]
+		value = variables[name] = value.inc() if op == 'inc' else value.dec()
+		return value
+
+	# Forgets every variable, so that a loop can reuse its scope for the next iteration
+	def reset(self):
+		self.scope.clear()
+		self.consts = None
 
 	def make_child_scope(self, is_pure: bool = True) -> 'Scope':
 		return Scope(self, is_pure)
 
-	def format_string(self, string: str) -> str:
-		# Replace escape sequences with the actual characters
-		for escape, value in ESCAPES.items():
-			string = string.replace(escape, value)
-		# todo: string formatting
-		return string
+	def invoke(self, func: Value, args: List[Value]) -> Value:
+		if not isinstance(func, FuncValue):
+			raise RuntimeError("Attempted to invoke a non-FuncValue value (value is: " + str(func) + ")")
+
+		# Check if purity matches
+		if not func.is_pure and self.pure:
+			raise RuntimeError("Cannot invoke impure functions in a pure scope.")
+
+		return func.invoke(self, args)
+
+	# `invoke` for calls in tail position: calls to a `Function` are left to the `Function` running
+	# this one, see `TailCall`
+	def tail_invoke(self, func: Value, args: List[Value]) -> Any:
+		if not isinstance(func, FuncValue):
+			raise RuntimeError("Attempted to invoke a non-FuncValue value (value is: " + str(func) + ")")
+		if not func.is_pure and self.pure:
+			raise RuntimeError("Cannot invoke impure functions in a pure scope.")
+		if type(func.value) is Function:
+			return TailCall(func, args, self)
+		return func.invoke(self, args)
 
 	# Set make_scope to False to force codeblocks to execute without making a new scope.
 	# This is used for `if` and `for` statements
-	def evaluate_expr(self, expr: LanguageParser.ExprContext, make_scope: bool = True) -> Value:
-		# print('eval: ', [c for c in expr.getChildren()])
-		if isinstance(expr, TerminalNodeImpl) or expr is None:
-			return Value(None)
-
-		# Literals
-		if expr.INT() is not None:
-			return Value(int(expr.INT().getText()))
-		elif expr.STRING() is not None:
-			return Value(self.format_string(expr.STRING().getText()[1:-1]))
-		elif expr.TRUE() is not None:
-			return Value(True)
-		elif expr.FALSE() is not None:
-			return Value(False)
-		# Control flow and friends
-		elif expr.expr_func() is not None:
-			func = expr.expr_func()
-			func_expr = func.stat().expr()
-
-			args = []
-			for arg_index in range(2, func.getChildCount() - 2):
-				argument = func.getChild(arg_index)
-				if isinstance(argument, TerminalNodeImpl) and argument.getText() == ',':
-					continue
-				args.append(argument.getText())
-
-			return FuncValue(args, func.PURE() is not None, lambda scope: scope.evaluate_expr(func_expr))
-		elif expr.part_invoke() is not None:
-			# Get the function
-			func = self.evaluate_expr(expr.getChild(0))
-			if not isinstance(func, FuncValue):
-				raise RuntimeError("Attempted to invoke a non-FuncValue value (value is: " + str(func) + ")")
-
-			# Check if purity matches
-			if not func.is_pure and self.pure:
-				raise RuntimeError("Cannot invoke impure functions in a pure scope.")
-
-			# Evaluate arguments
-			invoke = expr.part_invoke()
-			args = []
-			for arg_index in range(1, invoke.getChildCount() - 1):
-				argument = invoke.getChild(arg_index)
-				if isinstance(argument, TerminalNodeImpl) and argument.getText() == ',':
-					continue
-				args.append(self.evaluate_expr(argument))
-
-			# Invoke
-			return func.invoke(self, args)
-		elif expr.expr_block() is not None:
-			block = expr.expr_block()
-			is_pure = block.PURE() is not None
-			scope = self if not make_scope else self.make_child_scope(is_pure)
-			# If we are pure, there is an extra `pure` keyword denoting that, which must be ignored here.
-			start_index = 2 if is_pure else 1
-
-			for statement_index in range(start_index, block.getChildCount() - 1):
-				statement = block.getChild(statement_index)
-				if isinstance(statement, TerminalNodeImpl):
-					continue
-				if statement.stat_return() is not None:
-					return scope.evaluate_expr(statement.getChild(0).expr())
-				scope.evaluate_stat(statement)
-		elif expr.expr_if() is not None:
-			if_ = expr.expr_if()
-
-			if self.evaluate_expr(if_.getChild(2)).is_truthy():
-				return self.evaluate_expr(if_.getChild(4), make_scope = False)
-			elif if_.ELSE() is not None:
-				return self.evaluate_expr(if_.getChild(6), make_scope = False)
-		elif expr.expr_for() is not None:
-			pass
-		# Operators
-		elif expr.OP_DOT() is not None: return self.evaluate_expr(expr.getChild(0)).dot(expr.getChild(2).getText())
-		elif expr.OP_NOT() is not None: return Value(not self.evaluate_expr(expr.getChild(2)).value)
-		elif expr.OP_AND() is not None: return Value(self.evaluate_expr(expr.getChild(2)).value and expr.getChild(0).value)
-		elif expr.OP_OR() is not None: return Value(self.evaluate_expr(expr.getChild(2)).value or self.evaluate_expr(expr.getChild(0)))
-		elif expr.OP_EQ() is not None: return self.evaluate_expr(expr.getChild(2)).eq(self.evaluate_expr(expr.getChild(0)))
-		elif expr.OP_NEQ() is not None: return Value(not self.evaluate_expr(expr.getChild(2)).eq(self.evaluate_expr(expr.getChild(0))))
-		elif expr.OP_GT() is not None: return self.evaluate_expr(expr.getChild(2)).gt(self.evaluate_expr(expr.getChild(0)))
-		elif expr.OP_GTEQ() is not None: return self.evaluate_expr(expr.getChild(2)).gteq(self.evaluate_expr(expr.getChild(0)))
-		elif expr.OP_LT() is not None: return self.evaluate_expr(expr.getChild(2)).lt(self.evaluate_expr(expr.getChild(0)))
-		elif expr.OP_LTEQ() is not None: return self.evaluate_expr(expr.getChild(2)).lteq(self.evaluate_expr(expr.getChild(0)))
-		elif expr.OP_IS() is not None: return self.evaluate_expr(expr.getChild(2)).is_(self.evaluate_expr(expr.getChild(0)))
-		elif expr.OP_IN() is not None: return self.evaluate_expr(expr.getChild(2)).in_(self.evaluate_expr(expr.getChild(0)))
-		elif expr.OP_INC() is not None: return self.evaluate_expr(expr.getChild(0)).inc()
-		elif expr.OP_DEC() is not None: return self.evaluate_expr(expr.getChild(0)).dec()
-		# Math operators
-		elif expr.ADD() is not None: return self.evaluate_expr(expr.getChild(0)).add(self.evaluate_expr(expr.getChild(2)))
-		elif expr.SUB() is not None: return self.evaluate_expr(expr.getChild(0)).add(self.evaluate_expr(expr.getChild(2)))
-		elif expr.MUL() is not None: return self.evaluate_expr(expr.getChild(0)).add(self.evaluate_expr(expr.getChild(2)))
-		elif expr.DIV() is not None: return self.evaluate_expr(expr.getChild(0)).add(self.evaluate_expr(expr.getChild(2)))
-		elif expr.MOD() is not None: return self.evaluate_expr(expr.getChild(0)).add(self.evaluate_expr(expr.getChild(2)))
-		# ID
-		elif expr.ID() is not None:
-			return self.get(expr.ID().getText())
-
-		return Value(None)
-
-	def evaluate_stat(self, stat: LanguageParser.StatContext):
-		# print('evaluating statement: ' + stat.getText())
-		if isinstance(stat, TerminalNodeImpl):
-			return Value(None)
-		elif stat.stat_var() is not None:
-			stat_var = stat.stat_var()
-			self.new(stat_var.ID().symbol.text, self.evaluate_expr(stat_var.expr()))
-		elif stat.stat_const() is not None:
-			stat_const = stat.stat_const()
-			self.new(stat_const.ID().symbol.text, self.evaluate_expr(stat_const.expr()))
-		elif stat.stat_assign() is not None:
-			stat_assign = stat.stat_assign()
-			self.assign(stat_assign.ID().symbol.text, self.evaluate_expr(stat_assign.expr()))
-		elif stat.expr() is not None:
-			return self.evaluate_expr(stat.expr())
-		elif stat.stat_return() is not None:
-			self.returned_value = self.evaluate_expr(stat.stat_return().expr())
-			return self.returned_value
-		return Value(None)
+	def evaluate_expr(self, expr: Node, make_scope: bool = True) -> Value:
+		if not make_scope and type(expr) is Block:
+			return self.evaluate_block(expr, make_scope = False)
+		return EVALUATORS[type(expr)](self, expr)
+
+	def evaluate_stat(self, stat: Node) -> Value:
+		return EVALUATORS[type(stat)](self, stat)
+
+	def evaluate_program(self, program: Program):
+		for statement in program.body:
+			self.evaluate_stat(statement)
+
+	def evaluate_block(self, block: Block, make_scope: bool = True) -> Value:
+		scope = self if not make_scope else self.make_child_scope(block.is_pure)
+		for statement in block.body:
+			if type(statement) is Return:
+				return scope.evaluate_expr(statement.value)
+			scope.evaluate_stat(statement)
+		return NONE
+
+	# Expressions
+	def _literal(self, expr: Literal) -> Value:
+		return box(expr.value)
+
+	def _string(self, expr: String) -> Value:
+		return string_literal(expr.text)
+
+	def _template(self, expr: Template) -> Value:
+		return format_template(expr.strings, [self.evaluate_expr(part) for part in expr.exprs])
+
+	def _name(self, expr: Name) -> Value:
+		if expr.depth is None:
+			return self.get_global(expr.name)
+		return self.get_at(expr.depth, expr.name)
+
+	def _member(self, expr: Member) -> Value:
+		if expr.cache is None:
+			expr.cache = MemberCache(expr.name)
+		return expr.cache.get(self.evaluate_expr(expr.target))
+
+	def _unary_op(self, expr: UnaryOp) -> Value:
+		if expr.op == 'not':
+			return FALSE if self.evaluate_expr(expr.operand).value else TRUE
+		return self.step(expr.operand.depth, expr.operand.name, expr.op)
+
+	def _bin_op(self, expr: BinOp) -> Value:
+		return getattr(self.evaluate_expr(expr.left), expr.op)(self.evaluate_expr(expr.right))
+
+	def _logical(self, expr: Logical) -> Value:
+		left = self.evaluate_expr(expr.left)
+		if expr.op == 'and':
+			return self.evaluate_expr(expr.right) if left.value else left
+		return left if left.value else self.evaluate_expr(expr.right)
+
+	def _func(self, expr: Func) -> Value:
+		body = expr.body
+		return FuncValue(expr.args, expr.is_pure, Function(lambda scope: scope.evaluate_stat(body)))
+
+	def _invoke(self, expr: Invoke) -> Value:
+		if expr.tail:
+			return self.tail_invoke(self.evaluate_expr(expr.func), [self.evaluate_expr(arg) for arg in expr.args])
+		return self.invoke(self.evaluate_expr(expr.func), [self.evaluate_expr(arg) for arg in expr.args])
+
+	def _if(self, expr: If) -> Value:
+		if self.evaluate_expr(expr.cond).is_truthy():
+			return self.evaluate_expr(expr.then, make_scope = False)
+		elif expr.else_ is not None:
+			return self.evaluate_expr(expr.else_, make_scope = False)
+		return NONE
+
+	def _for(self, expr: For) -> Value:
+		scope = self.make_child_scope(False)
+		scope.evaluate_expr(expr.init)
+		# Look the evaluators up once instead of going through `evaluate_expr` for every iteration
+		cond, evaluate_cond = expr.cond, EVALUATORS[type(expr.cond)]
+		step, evaluate_step = expr.step, EVALUATORS[type(expr.step)]
+		statements = [(EVALUATORS[type(statement)], statement) for statement in expr.statements()]
+		is_pure = expr.is_pure()
+		body = scope
+		while evaluate_cond(scope, cond).is_truthy():
+			if is_pure:
+				body = scope.make_child_scope(True)
+			elif scope.scope:
+				scope.reset()
+			for evaluate, statement in statements:
+				if type(statement) is Return:
+					return body.evaluate_expr(statement.value)
+				evaluate(body, statement)
+			evaluate_step(scope, step)
+		return NONE
+
+	# Statements
+	def _var(self, stat: Var) -> Value:
+		self.new(stat.name, self.evaluate_expr(stat.value), stat.is_const)
+		return NONE
+
+	def _assign(self, stat: Assign) -> Value:
+		if stat.depth is None:
+			self.assign(stat.name, self.evaluate_expr(stat.value))
+		else:
+			self.assign_at(stat.depth, stat.name, self.evaluate_expr(stat.value))
+		return NONE
+
+	def _return(self, stat: Return) -> Value:
+		self.returned_value = self.evaluate_expr(stat.value)
+		return self.returned_value
 
 	def __enter__(self):
 		return self
 
 	def __exit__(self, *args):
 		pass
+
+
+# Node type -> evaluator, used by `Scope.evaluate_expr` and `Scope.evaluate_stat`
+EVALUATORS: Dict[type, Callable[[Scope, Any], Value]] = {
+	Literal: Scope._literal,
+	String: Scope._string,
+	Template: Scope._template,
+	Name: Scope._name,
+	Member: Scope._member,
+	UnaryOp: Scope._unary_op,
+	BinOp: Scope._bin_op,
+	Logical: Scope._logical,
+	Func: Scope._func,
+	Invoke: Scope._invoke,
+	Block: Scope.evaluate_block,
+	If: Scope._if,
+	For: Scope._for,
+	Var: Scope._var,
+	Assign: Scope._assign,
+	Return: Scope._return,
+}
@@ -0,0 +1,186 @@
+import sys
+from typing import List
+import antlr4
+from antlr4.tree.Tree import TerminalNodeImpl
+
+from prototype.nodes import Assign, BinOp, Block, For, Func, If, Invoke, Literal, Logical, Member, Name, Node, Program, Return, String, Template, UnaryOp, Var
+from prototype.syntax.LanguageLexer import LanguageLexer
+from prototype.syntax.LanguageParser import LanguageParser
+
+
+# Operator token -> name of the `Value` method implementing it
+BINARY_OPS = {
+	LanguageParser.OP_IS: 'is_',
+	LanguageParser.OP_IN: 'in_',
+	LanguageParser.OP_EQ: 'eq',
+	LanguageParser.OP_NEQ: 'neq',
+	LanguageParser.OP_GT: 'gt',
+	LanguageParser.OP_GTEQ: 'gteq',
+	LanguageParser.OP_LT: 'lt',
+	LanguageParser.OP_LTEQ: 'lteq',
+	LanguageParser.ADD: 'add',
+	LanguageParser.SUB: 'sub',
+	LanguageParser.MUL: 'mul',
+	LanguageParser.DIV: 'div',
+	LanguageParser.MOD: 'mod',
+}
+
+LOGICAL_OPS = {
+	LanguageParser.OP_AND: 'and',
+	LanguageParser.OP_OR: 'or',
+}
+
+POSTFIX_OPS = {
+	LanguageParser.OP_INC: 'inc',
+	LanguageParser.OP_DEC: 'dec',
+}
+
+# Escape sequence -> the character it stands for. `\$` is a dollar sign that does not start an
+# interpolation.
+ESCAPES = {
+	"\\\"": "\"",
+	"\\'": "'",
+	"\\r": "\r",
+	"\\n": "\n",
+	"\\t": "\t",
+	"\\f": "\f",
+	"\\$": "$",
+}
+
+
+# Turns an ANTLR parse tree into the compact AST in `prototype.nodes`. After this the parse tree (and
+# with it the token stream) can be dropped.
+def lower(tree: LanguageParser.ProgramContext) -> Program:
+	return Program([lower_stat(stat) for stat in tree.stat()])
+
+
+def lower_stat(stat: LanguageParser.StatContext) -> Node:
+	if stat is None:
+		return Literal(None)
+	child = stat.getChild(0)
+	if isinstance(child, LanguageParser.Stat_varContext):
+		return Var(child.ID().getText(), lower_expr(child.expr()))
+	elif isinstance(child, LanguageParser.Stat_constContext):
+		return Var(child.ID().getText(), lower_expr(child.expr()), is_const = True)
+	elif isinstance(child, LanguageParser.Stat_assignContext):
+		return Assign(child.ID().getText(), lower_expr(child.expr()))
+	elif isinstance(child, LanguageParser.Stat_returnContext):
+		return Return(lower_expr(child.expr()))
+	return lower_expr(child)
+
+
+def lower_exprs(exprs: List[LanguageParser.ExprContext]) -> List[Node]:
+	return [lower_expr(expr) for expr in exprs]
+
+
+def lower_expr(expr: LanguageParser.ExprContext) -> Node:
+	# Incomplete trees from syntax errors evaluate to nothing, like they always have
+	if expr is None or isinstance(expr, TerminalNodeImpl):
+		return Literal(None)
+
+	count = expr.getChildCount()
+	first = expr.getChild(0)
+
+	if count == 1:
+		if isinstance(first, TerminalNodeImpl):
+			kind = first.symbol.type
+			text = first.getText()
+			if kind == LanguageParser.INT:
+				return Literal(int(text))
+			elif kind == LanguageParser.STRING:
+				return lower_string(text[1:-1])
+			elif kind == LanguageParser.TRUE:
+				return Literal(True)
+			elif kind == LanguageParser.FALSE:
+				return Literal(False)
+			elif kind == LanguageParser.ID:
+				return Name(text)
+		elif isinstance(first, LanguageParser.Expr_funcContext):
+			return Func([arg.getText() for arg in first.ID()], first.PURE() is not None, lower_stat(first.stat()))
+		elif isinstance(first, LanguageParser.Expr_blockContext):
+			return Block(first.PURE() is not None, [lower_stat(stat) for stat in first.stat()])
+		elif isinstance(first, LanguageParser.Expr_ifContext):
+			parts = lower_exprs(first.expr())
+			return If(parts[0], parts[1], parts[2] if len(parts) > 2 else None)
+		elif isinstance(first, LanguageParser.Expr_forContext):
+			init, cond, step = lower_exprs(first.expr())
+			return For(init, cond, step, lower_stat(first.stat()))
+	elif count == 2:
+		second = expr.getChild(1)
+		if isinstance(first, TerminalNodeImpl):
+			return UnaryOp('not', lower_expr(second))
+		elif isinstance(second, LanguageParser.Part_invokeContext):
+			return Invoke(lower_expr(first), lower_exprs(second.expr()))
+		elif isinstance(second, TerminalNodeImpl) and second.symbol.type in POSTFIX_OPS:
+			# These rebind a variable, see `Scope.step`
+			operand = lower_expr(first)
+			if type(operand) is not Name:
+				raise RuntimeError(f"Only variables can be incremented or decremented: {expr.getText()}")
+			return UnaryOp(POSTFIX_OPS[second.symbol.type], operand)
+	elif count == 3 and isinstance(expr.getChild(1), TerminalNodeImpl):
+		kind = expr.getChild(1).symbol.type
+		if kind == LanguageParser.OP_DOT:
+			return Member(lower_expr(first), expr.getChild(2).getText())
+		elif kind in LOGICAL_OPS:
+			return Logical(LOGICAL_OPS[kind], lower_expr(first), lower_expr(expr.getChild(2)))
+		elif kind in BINARY_OPS:
+			return BinOp(BINARY_OPS[kind], lower_expr(first), lower_expr(expr.getChild(2)))
+
+	return Literal(None)
+
+
+# Strings are decoded here, once, and interned: evaluating a literal is a lookup, see
+# `prototype.interpreter.string_literal`
+def decode(text: str) -> str:
+	for escape, value in ESCAPES.items():
+		text = text.replace(escape, value)
+	return sys.intern(text)
+
+
+# "Hello ${name}!" interpolates the expression between the braces. Braces without a `$` are just
+# text, like in Python code for `py_eval`. The text around the expressions is decoded now and the
+# expressions are parsed now, so formatting at runtime is a single join.
+def lower_string(text: str) -> Node:
+	strings = []
+	exprs = []
+	start = index = 0
+	while index < len(text):
+		char = text[index]
+		if char == '\\':
+			index += 2
+		elif char == '$' and text.startswith('{', index + 1):
+			end = closing_brace(text, index + 1)
+			strings.append(decode(text[start:index]))
+			exprs.append(lower_interpolation(decode(text[index + 2:end])))
+			start = index = end + 1
+		else:
+			index += 1
+	strings.append(decode(text[start:]))
+	if not exprs:
+		return String(strings[0])
+	return Template(strings, exprs)
+
+
+def closing_brace(text: str, start: int) -> int:
+	depth = 0
+	index = start
+	while index < len(text):
+		char = text[index]
+		if char == '\\':
+			index += 1
+		elif char == '{':
+			depth += 1
+		elif char == '}':
+			depth -= 1
+			if depth == 0:
+				return index
+		index += 1
+	raise RuntimeError(f"Unterminated interpolation in string: \"{text}\"")
+
+
+def lower_interpolation(source: str) -> Node:
+	parser = LanguageParser(antlr4.CommonTokenStream(LanguageLexer(antlr4.InputStream(source))))
+	expr = parser.expr()
+	if parser.getNumberOfSyntaxErrors() or parser.getTokenStream().LA(1) != antlr4.Token.EOF:
+		raise RuntimeError(f"Invalid interpolation in string: ${{{source}}}")
+	return lower_expr(expr)
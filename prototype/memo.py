@@ -0,0 +1,125 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Tuple
+
+from prototype.interpreter import PROGRAM_FUNCTIONS, FuncValue, ListValue, RopeValue, Scope, TableValue, Value
+
+
+# Structural key for an argument: equal contents give equal keys, so two lists holding the same
+# values hit the same entry. Long strings key on their text like short ones. Functions and natives
+# are compared by identity.
+def memo_key(value: Any) -> Hashable:
+	kind = type(value)
+	if kind is ListValue:
+		return (kind, tuple(memo_key(item) for item in value.value))
+	elif kind is TableValue:
+		return (kind, frozenset((index, memo_key(item)) for index, item in value.value.items()))
+	elif isinstance(value, Value):
+		if kind is not Value and kind is not RopeValue:
+			return (kind, value)
+		value = value.value
+	# The type keeps 1 and true (and 1.0) apart
+	return (type(value), value)
+
+
+# Every caller gets its own copy-on-write view of a cached list or table, so changing a result never
+# changes what later callers get
+def handed_out(value: Value) -> Value:
+	if type(value) is ListValue or type(value) is TableValue:
+		return value.share()
+	return value
+
+
+# Opt-in cache for pure functions, see the `memoize` builtin. Purity means the result only depends on
+# the arguments, so the wrapped function is called once per distinct argument list and the result is
+# shared with every later caller. Entries are evicted least recently used first, per function and
+# across all memoized functions.
+class Memo:
+	__slots__ = ('func', 'entries', 'limit', 'hits', 'misses', 'evictions')
+	func: FuncValue
+	entries: 'OrderedDict[Hashable, Value]'
+	limit: int
+	hits: int
+	misses: int
+	evictions: int
+
+	default_limit = 1024
+	global_limit = 65536
+
+	# (memo, key) for every entry of every memo, least recently used first
+	lru: 'OrderedDict[Tuple[Memo, Hashable], None]' = OrderedDict()
+	totals = { 'functions': 0, 'hits': 0, 'misses': 0, 'uncacheable': 0, 'evictions': 0 }
+
+	def __init__(self, func: FuncValue, limit: int):
+		self.func = func
+		self.entries = OrderedDict()
+		self.limit = limit
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		Memo.totals['functions'] += 1
+
+	def __call__(self, scope: Scope) -> Value:
+		try:
+			key = tuple(memo_key(scope.scope.get(name)) for name in self.func.args)
+			hash(key)
+		except TypeError:
+			# Something unhashable, like a native object, just skips the cache
+			Memo.totals['uncacheable'] += 1
+			return self.func.value(scope)
+
+		entries = self.entries
+		if key in entries:
+			self.hits += 1
+			Memo.totals['hits'] += 1
+			entries.move_to_end(key)
+			Memo.lru.move_to_end((self, key))
+			return handed_out(entries[key])
+
+		self.misses += 1
+		Memo.totals['misses'] += 1
+		value = self.func.value(scope)
+		entries[key] = value
+		Memo.lru[(self, key)] = None
+		if len(entries) > self.limit:
+			self.evict(next(iter(entries)))
+		if len(Memo.lru) > Memo.global_limit:
+			memo, oldest = next(iter(Memo.lru))
+			memo.evict(oldest)
+		return handed_out(value)
+
+	def evict(self, key: Hashable):
+		del self.entries[key]
+		del Memo.lru[(self, key)]
+		self.evictions += 1
+		Memo.totals['evictions'] += 1
+
+	def info(self) -> TableValue:
+		return TableValue({
+			'hits': Value(self.hits),
+			'misses': Value(self.misses),
+			'evictions': Value(self.evictions),
+			'size': Value(len(self.entries)),
+			'limit': Value(self.limit),
+		})
+
+	@staticmethod
+	def stats() -> Dict[str, int]:
+		return { **Memo.totals, 'entries': len(Memo.lru) }
+
+
+# Memoized functions are still functions of the program
+PROGRAM_FUNCTIONS.add(Memo)
+
+
+# Builtin: memoize(func, size?) returns a memoized copy of a pure function. The copy has a
+# `cache_info()` member returning its counters as a table.
+def memoize(scope: Scope) -> FuncValue:
+	func = scope.get('func')
+	if not isinstance(func, FuncValue) or not func.is_pure:
+		raise RuntimeError("Only pure functions can be memoized.")
+	limit = scope.get('size').value if scope.has_own('size') else Memo.default_limit
+
+	memo = Memo(func, limit)
+	memoized = FuncValue(func.args, True, memo)
+	memoized.members['cache_info'] = FuncValue([], True, lambda scope: memo.info())
+	return memoized
@@ -0,0 +1,45 @@
+import os
+from typing import Callable, Dict, List
+
+from prototype.interpreter import Value
+
+
+# Like `sys.modules`: every module is evaluated once per process and later imports get the same value
+# back. Modules are keyed by their resolved path, so `a/../b.pipe` and `b.pipe` are one module.
+class ModuleRegistry:
+	modules: Dict[str, Value]
+	loading: List[str]
+	hits: int
+	misses: int
+
+	def __init__(self):
+		self.modules = {}
+		self.loading = []
+		self.hits = 0
+		self.misses = 0
+
+	def load(self, path: str, loader: Callable[[str], Value]) -> Value:
+		key = os.path.realpath(path)
+		if key in self.modules:
+			self.hits += 1
+			return self.modules[key]
+
+		# A module that is still being evaluated has no value to hand out yet
+		if key in self.loading:
+			chain = self.loading[self.loading.index(key):] + [key]
+			raise RuntimeError("Circular import: " + " -> ".join(chain))
+
+		self.misses += 1
+		self.loading.append(key)
+		try:
+			value = loader(path)
+		finally:
+			self.loading.pop()
+		self.modules[key] = value
+		return value
+
+	def stats(self) -> Dict[str, int]:
+		return { 'modules': len(self.modules), 'hits': self.hits, 'misses': self.misses }
+
+
+registry = ModuleRegistry()
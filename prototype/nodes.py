@@ -0,0 +1,224 @@
+from typing import Any, Iterator, List, Optional
+
+
+# Compact AST produced by `prototype.lower`. The evaluator dispatches on the node's type rather than
+# poking at ANTLR contexts, so these only carry what evaluation actually needs.
+class Node:
+	__slots__ = ()
+
+	def __repr__(self) -> str:
+		fields = ', '.join(f'{name}={getattr(self, name)!r}' for name in self.__slots__)
+		return f'{type(self).__name__}({fields})'
+
+	def children(self) -> Iterator['Node']:
+		for name in self.__slots__:
+			field = getattr(self, name)
+			if isinstance(field, Node):
+				yield field
+			elif isinstance(field, list):
+				yield from (item for item in field if isinstance(item, Node))
+
+
+# Expressions
+
+class Literal(Node):
+	__slots__ = ('value',)
+	value: Any
+
+	def __init__(self, value: Any):
+		self.value = value
+
+
+class String(Node):
+	__slots__ = ('text',)
+	text: str
+
+	# `text` is the literal without its quotes, escapes already decoded by `prototype.lower`
+	def __init__(self, text: str):
+		self.text = text
+
+
+# A string with interpolated expressions: `strings` are the pieces of text around `exprs`, one more
+# than there are expressions
+class Template(Node):
+	__slots__ = ('strings', 'exprs')
+	strings: List[str]
+	exprs: List[Node]
+
+	def __init__(self, strings: List[str], exprs: List[Node]):
+		self.strings = strings
+		self.exprs = exprs
+
+
+class Name(Node):
+	__slots__ = ('name', 'depth')
+	name: str
+	depth: Optional[int]
+
+	# `depth` is filled in by `prototype.resolve`, None means the name is free in its function
+	def __init__(self, name: str, depth: Optional[int] = None):
+		self.name = name
+		self.depth = depth
+
+
+class Member(Node):
+	__slots__ = ('target', 'name', 'cache')
+	target: Node
+	name: str
+	cache: Any
+
+	# `cache` is the site's `MemberCache`, created by the tree evaluator on first use
+	def __init__(self, target: Node, name: str):
+		self.target = target
+		self.name = name
+		self.cache = None
+
+
+class UnaryOp(Node):
+	__slots__ = ('op', 'operand')
+	op: str
+	operand: Node
+
+	# `op` is one of 'not', 'inc' or 'dec'. The operand of 'inc' and 'dec' is always a Name.
+	def __init__(self, op: str, operand: Node):
+		self.op = op
+		self.operand = operand
+
+
+class BinOp(Node):
+	__slots__ = ('op', 'left', 'right')
+	op: str
+	left: Node
+	right: Node
+
+	# `op` is the name of the `Value` method implementing the operator (`add`, `eq`, `in_`, ...)
+	def __init__(self, op: str, left: Node, right: Node):
+		self.op = op
+		self.left = left
+		self.right = right
+
+
+class Logical(Node):
+	__slots__ = ('op', 'left', 'right')
+	op: str
+	left: Node
+	right: Node
+
+	# `op` is either 'and' or 'or', both short-circuit
+	def __init__(self, op: str, left: Node, right: Node):
+		self.op = op
+		self.left = left
+		self.right = right
+
+
+class Func(Node):
+	__slots__ = ('args', 'is_pure', 'body')
+	args: List[str]
+	is_pure: bool
+	body: Node
+
+	def __init__(self, args: List[str], is_pure: bool, body: Node):
+		self.args = args
+		self.is_pure = is_pure
+		self.body = body
+
+
+class Invoke(Node):
+	__slots__ = ('func', 'args', 'tail')
+	func: Node
+	args: List[Node]
+	# Set by `prototype.resolve` when the function making the call returns its result as is
+	tail: bool
+
+	def __init__(self, func: Node, args: List[Node], tail: bool = False):
+		self.func = func
+		self.args = args
+		self.tail = tail
+
+
+class Block(Node):
+	__slots__ = ('is_pure', 'body')
+	is_pure: bool
+	body: List[Node]
+
+	def __init__(self, is_pure: bool, body: List[Node]):
+		self.is_pure = is_pure
+		self.body = body
+
+
+class If(Node):
+	__slots__ = ('cond', 'then', 'else_')
+	cond: Node
+	then: Node
+	else_: Optional[Node]
+
+	def __init__(self, cond: Node, then: Node, else_: Optional[Node]):
+		self.cond = cond
+		self.then = then
+		self.else_ = else_
+
+
+class For(Node):
+	__slots__ = ('init', 'cond', 'step', 'body')
+	init: Node
+	cond: Node
+	step: Node
+	body: Node
+
+	def __init__(self, init: Node, cond: Node, step: Node, body: Node):
+		self.init = init
+		self.cond = cond
+		self.step = step
+		self.body = body
+
+	# A loop makes one impure scope for all of its iterations, so that the step can rebind variables
+	# declared outside of the loop. The body runs in it directly, like the branches of an `if`, and the
+	# scope is emptied between iterations. A `pure` body instead runs in a new pure child of it every
+	# iteration. A `return` in the body ends the loop.
+	def statements(self) -> List[Node]:
+		return self.body.body if type(self.body) is Block else [self.body]
+
+	def is_pure(self) -> bool:
+		return type(self.body) is Block and self.body.is_pure
+
+
+# Statements (any expression is also a valid statement)
+
+class Var(Node):
+	__slots__ = ('name', 'value', 'is_const')
+	name: str
+	value: Node
+	is_const: bool
+
+	def __init__(self, name: str, value: Node, is_const: bool = False):
+		self.name = name
+		self.value = value
+		self.is_const = is_const
+
+
+class Assign(Node):
+	__slots__ = ('name', 'value', 'depth')
+	name: str
+	value: Node
+	depth: Optional[int]
+
+	def __init__(self, name: str, value: Node, depth: Optional[int] = None):
+		self.name = name
+		self.value = value
+		self.depth = depth
+
+
+class Return(Node):
+	__slots__ = ('value',)
+	value: Node
+
+	def __init__(self, value: Node):
+		self.value = value
+
+
+class Program(Node):
+	__slots__ = ('body',)
+	body: List[Node]
+
+	def __init__(self, body: List[Node]):
+		self.body = body
@@ -0,0 +1,109 @@
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing.pool import MaybeEncodingError
+from typing import Dict, List, Optional, Tuple
+
+from prototype.interpreter import FuncValue, ListValue, Scope, Value
+
+
+# Maps pure callbacks over lists on several cores for the `par_map` builtin, which programs opt into
+# explicitly: `for_each` always maps serially. Workers are forked for every parallel map and inherit
+# the callback, its scope and the list, so only the bounds of each chunk go out and only the results
+# come back.
+#
+# Whether a map runs in parallel depends on the machine (cores, `fork`) and on timing, so `par_map`
+# is only for callbacks that compute their result from their argument alone. `pure` does not
+# guarantee that: a pure function can still `append` to or `put` into a list or table it reaches
+# from outside, and under `par_map` those changes happen in a worker and are lost, except for the
+# first `PROBE_ITEMS` items, which are mapped in the calling process.
+#
+# Mapping stays serial for impure callbacks, short lists, cheap callbacks and where `fork` is not
+# available.
+
+# Lists shorter than this are always mapped serially
+MIN_ITEMS = 256
+# How many items are mapped serially first to time the callback
+PROBE_ITEMS = 32
+# Remaining work estimated to take less than this many seconds serially is not worth forking for
+MIN_SECONDS = 0.1
+# Chunks are sized to take about this long, with at least `CHUNKS_PER_WORKER` per worker so that
+# workers finishing early can pick up more
+CHUNK_SECONDS = 0.05
+CHUNKS_PER_WORKER = 4
+
+totals = { 'serial': 0, 'parallel': 0, 'chunks': 0, 'unpicklable': 0 }
+
+# (callback, scope, items) of the map in progress, inherited by the workers
+job: Optional[Tuple[FuncValue, Scope, List[Value]]] = None
+# True in worker processes, which map serially
+in_worker = False
+
+
+def workers() -> int:
+	if in_worker or 'fork' not in multiprocessing.get_all_start_methods():
+		return 1
+	return len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+
+
+def map_values(callback: FuncValue, scope: Scope, items: List[Value]) -> List[Value]:
+	count = workers()
+	if count < 2 or not isinstance(callback, FuncValue) or not callback.is_pure or len(items) < MIN_ITEMS:
+		totals['serial'] += 1
+		return [callback.invoke(scope, [item]) for item in items]
+
+	started = time.perf_counter()
+	head = [callback.invoke(scope, [item]) for item in items[:PROBE_ITEMS]]
+	per_item = (time.perf_counter() - started) / len(head)
+	remaining = len(items) - len(head)
+	if per_item * remaining < MIN_SECONDS:
+		totals['serial'] += 1
+		return head + [callback.invoke(scope, [item]) for item in items[PROBE_ITEMS:]]
+
+	size = max(1, min(int(CHUNK_SECONDS / per_item), remaining // (count * CHUNKS_PER_WORKER)))
+	bounds = [(start, min(start + size, len(items))) for start in range(PROBE_ITEMS, len(items), size)]
+
+	global job
+	job = (callback, scope, items)
+	# Anything still buffered would be written again by every worker
+	sys.stdout.flush()
+	sys.stderr.flush()
+	try:
+		with multiprocessing.get_context('fork').Pool(min(count, len(bounds)), initializer = started_worker) as pool:
+			chunks = pool.map(map_chunk, bounds, chunksize = 1)
+	except MaybeEncodingError:
+		# Results that cannot be sent back, like functions
+		totals['unpicklable'] += 1
+		totals['serial'] += 1
+		return head + [callback.invoke(scope, [item]) for item in items[PROBE_ITEMS:]]
+	finally:
+		job = None
+
+	totals['parallel'] += 1
+	totals['chunks'] += len(bounds)
+	return head + [value for chunk in chunks for value in chunk]
+
+
+def started_worker():
+	global in_worker
+	in_worker = True
+
+
+def map_chunk(bounds: Tuple[int, int]) -> List[Value]:
+	callback, scope, items = job
+	start, stop = bounds
+	return [callback.invoke(scope, [item]) for item in items[start:stop]]
+
+
+# Builtin: par_map(items, callback) is `items.for_each(callback)`, spread over all cores when the
+# callback is pure
+def par_map(scope: Scope) -> ListValue:
+	items = scope.get('items')
+	if not isinstance(items, ListValue):
+		raise RuntimeError("par_map expects a list (value is: " + str(items) + ")")
+	return ListValue(map_values(scope.get('callback'), scope, items.value))
+
+
+def stats() -> Dict[str, int]:
+	return { **totals, 'workers': workers() }
@@ -0,0 +1,399 @@
+from typing import Any, Callable, Iterator, Optional, Tuple, Union
+
+from prototype.interpreter import FALSE, TRUE, ListValue, Method, Scope, SeqValue, TableValue, Value, box
+
+
+# Immutable tables and lists for pure code. Updating one gives a new collection that shares all but
+# O(log n) of its structure with the original, so returning a modified copy is cheap and the
+# original stays as it was.
+
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+HASH_BITS = 64
+
+
+# Tables: a hash array mapped trie. Each node has a bitmap of which of its 32 slots are taken and a
+# tuple with just the taken ones. An entry is either a leaf (hash, key, value), a `Node` one level
+# down or a `Collision` of keys whose hashes are the same.
+class Node:
+	__slots__ = ('bitmap', 'entries')
+	bitmap: int
+	entries: tuple
+
+	def __init__(self, bitmap: int, entries: tuple):
+		self.bitmap = bitmap
+		self.entries = entries
+
+
+class Collision:
+	__slots__ = ('hash', 'pairs')
+	hash: int
+	pairs: Tuple[Tuple[Any, Value], ...]
+
+	def __init__(self, hash: int, pairs: Tuple[Tuple[Any, Value], ...]):
+		self.hash = hash
+		self.pairs = pairs
+
+
+Entry = Union[tuple, Node, Collision]
+EMPTY_NODE = Node(0, ())
+
+
+def key_hash(key: Any) -> int:
+	return hash(key) & ((1 << HASH_BITS) - 1)
+
+
+def entry_hash(entry: Entry) -> int:
+	return entry.hash if type(entry) is Collision else entry[0]
+
+
+# A node holding two entries with different hashes, as deep as it takes to tell them apart
+def merge(shift: int, first: Entry, second: Entry) -> Node:
+	first_hash, second_hash = entry_hash(first), entry_hash(second)
+	first_slot, second_slot = (first_hash >> shift) & MASK, (second_hash >> shift) & MASK
+	if first_slot == second_slot:
+		return Node(1 << first_slot, (merge(shift + BITS, first, second),))
+	if first_slot > second_slot:
+		first, second = second, first
+	return Node((1 << first_slot) | (1 << second_slot), (first, second))
+
+
+def node_get(node: Node, hash: int, key: Any) -> Optional[Value]:
+	shift = 0
+	while True:
+		bit = 1 << ((hash >> shift) & MASK)
+		if not node.bitmap & bit:
+			return None
+		entry = node.entries[(node.bitmap & (bit - 1)).bit_count()]
+		kind = type(entry)
+		if kind is tuple:
+			return entry[2] if entry[0] == hash and entry[1] == key else None
+		elif kind is Collision:
+			for pair_key, value in entry.pairs:
+				if pair_key == key:
+					return value
+			return None
+		node = entry
+		shift += BITS
+
+
+# The node with `key` set to `value`, and whether the key is new
+def node_assoc(node: Node, shift: int, hash: int, key: Any, value: Value) -> Tuple[Node, bool]:
+	bit = 1 << ((hash >> shift) & MASK)
+	index = (node.bitmap & (bit - 1)).bit_count()
+	entries = node.entries
+	if not node.bitmap & bit:
+		return Node(node.bitmap | bit, entries[:index] + ((hash, key, value),) + entries[index:]), True
+
+	entry = entries[index]
+	kind = type(entry)
+	added = True
+	if kind is tuple:
+		if entry[0] == hash and entry[1] == key:
+			if entry[2] is value:
+				return node, False
+			replacement, added = (hash, key, value), False
+		elif entry[0] == hash:
+			replacement = Collision(hash, ((entry[1], entry[2]), (key, value)))
+		else:
+			replacement = merge(shift + BITS, entry, (hash, key, value))
+	elif kind is Collision:
+		if entry.hash == hash:
+			pairs = tuple(pair for pair in entry.pairs if pair[0] != key)
+			added = len(pairs) == len(entry.pairs)
+			replacement = Collision(hash, pairs + ((key, value),))
+		else:
+			replacement = merge(shift + BITS, entry, (hash, key, value))
+	else:
+		replacement, added = node_assoc(entry, shift + BITS, hash, key, value)
+		if replacement is entry:
+			return node, False
+	return Node(node.bitmap, entries[:index] + (replacement,) + entries[index + 1:]), added
+
+
+# The node without `key`, None if that leaves it empty. Nodes are not collapsed on the way back up.
+def node_dissoc(node: Node, shift: int, hash: int, key: Any) -> Optional[Node]:
+	bit = 1 << ((hash >> shift) & MASK)
+	if not node.bitmap & bit:
+		return node
+	index = (node.bitmap & (bit - 1)).bit_count()
+	entries = node.entries
+	entry = entries[index]
+	kind = type(entry)
+	if kind is tuple:
+		if entry[0] != hash or entry[1] != key:
+			return node
+		replacement = None
+	elif kind is Collision:
+		pairs = tuple(pair for pair in entry.pairs if pair[0] != key)
+		if len(pairs) == len(entry.pairs):
+			return node
+		replacement = Collision(hash, pairs) if len(pairs) > 1 else (hash, pairs[0][0], pairs[0][1])
+	else:
+		replacement = node_dissoc(entry, shift + BITS, hash, key)
+		if replacement is entry:
+			return node
+
+	if replacement is not None:
+		return Node(node.bitmap, entries[:index] + (replacement,) + entries[index + 1:])
+	if node.bitmap == bit:
+		return None
+	return Node(node.bitmap & ~bit, entries[:index] + entries[index + 1:])
+
+
+def node_items(node: Node) -> Iterator[Tuple[Any, Value]]:
+	for entry in node.entries:
+		kind = type(entry)
+		if kind is tuple:
+			yield entry[1], entry[2]
+		elif kind is Collision:
+			yield from entry.pairs
+		else:
+			yield from node_items(entry)
+
+
+class Hamt:
+	__slots__ = ('root', 'count')
+	root: Node
+	count: int
+
+	def __init__(self, root: Node = EMPTY_NODE, count: int = 0):
+		self.root = root
+		self.count = count
+
+	def get(self, key: Any) -> Optional[Value]:
+		return node_get(self.root, key_hash(key), key)
+
+	def assoc(self, key: Any, value: Value) -> 'Hamt':
+		root, added = node_assoc(self.root, 0, key_hash(key), key, value)
+		return self if root is self.root else Hamt(root, self.count + added)
+
+	def dissoc(self, key: Any) -> 'Hamt':
+		root = node_dissoc(self.root, 0, key_hash(key), key)
+		if root is self.root:
+			return self
+		return Hamt(root or EMPTY_NODE, self.count - 1)
+
+	def items(self) -> Iterator[Tuple[Any, Value]]:
+		return node_items(self.root)
+
+
+# Lists: a persistent vector, a trie of 32-wide tuples holding the items in order plus a tail of up
+# to 32 items that pushes fill before it goes into the trie.
+class Vector:
+	__slots__ = ('count', 'shift', 'root', 'tail')
+	count: int
+	shift: int
+	root: tuple
+	tail: tuple
+
+	def __init__(self, count: int = 0, shift: int = BITS, root: tuple = (), tail: tuple = ()):
+		self.count = count
+		self.shift = shift
+		self.root = root
+		self.tail = tail
+
+	# Index of the first item in the tail
+	def tail_offset(self) -> int:
+		return 0 if self.count < WIDTH else ((self.count - 1) >> BITS) << BITS
+
+	def index(self, index: int) -> int:
+		if index < 0:
+			index += self.count
+		if not 0 <= index < self.count:
+			raise IndexError("list index out of range")
+		return index
+
+	def get(self, index: int) -> Value:
+		index = self.index(index)
+		offset = self.tail_offset()
+		if index >= offset:
+			return self.tail[index - offset]
+		node = self.root
+		for level in range(self.shift, 0, -BITS):
+			node = node[(index >> level) & MASK]
+		return node[index & MASK]
+
+	def push(self, value: Value) -> 'Vector':
+		if len(self.tail) < WIDTH:
+			return Vector(self.count + 1, self.shift, self.root, self.tail + (value,))
+		# The full tail moves into the trie, which grows a level when the root is full too
+		if (self.count >> BITS) > (1 << self.shift):
+			root, shift = (self.root, new_path(self.shift, self.tail)), self.shift + BITS
+		else:
+			root, shift = push_tail(self.count, self.shift, self.root, self.tail), self.shift
+		return Vector(self.count + 1, shift, root, (value,))
+
+	def assoc(self, index: int, value: Value) -> 'Vector':
+		if index == self.count:
+			return self.push(value)
+		index = self.index(index)
+		offset = self.tail_offset()
+		if index >= offset:
+			tail = self.tail
+			return Vector(self.count, self.shift, self.root, tail[:index - offset] + (value,) + tail[index - offset + 1:])
+		return Vector(self.count, self.shift, assoc_path(self.shift, self.root, index, value), self.tail)
+
+	def items(self) -> Iterator[Value]:
+		yield from leaves(self.shift, self.root)
+		yield from self.tail
+
+
+def new_path(level: int, node: tuple) -> tuple:
+	while level > 0:
+		node = (node,)
+		level -= BITS
+	return node
+
+
+def push_tail(count: int, level: int, parent: tuple, tail: tuple) -> tuple:
+	slot = ((count - 1) >> level) & MASK
+	if level == BITS:
+		child = tail
+	elif slot < len(parent):
+		child = push_tail(count, level - BITS, parent[slot], tail)
+	else:
+		child = new_path(level - BITS, tail)
+	return parent[:slot] + (child,) + parent[slot + 1:]
+
+
+def assoc_path(level: int, node: tuple, index: int, value: Value) -> tuple:
+	slot = (index >> level) & MASK
+	child = value if level == 0 else assoc_path(level - BITS, node[slot], index, value)
+	return node[:slot] + (child,) + node[slot + 1:]
+
+
+def leaves(level: int, node: tuple) -> Iterator[Value]:
+	if level == 0:
+		yield from node
+	else:
+		for child in node:
+			yield from leaves(level - BITS, child)
+
+
+class PersistentTableValue(Value):
+	__slots__ = ()
+
+	def __init__(self, value: Optional[Hamt] = None):
+		super().__init__(value or Hamt())
+
+	# Entries come before methods, like for tables
+	def dot(self, id_: str) -> Value:
+		value = self.value.get(id_)
+		if value is not None:
+			return value
+		return super().dot(id_)
+
+	@classmethod
+	def member_getter(cls, id_: str) -> Callable[[Value], Value]:
+		return lambda table: table.dot(id_)
+
+	# Methods
+	def _get(self, scope: Scope) -> Value:
+		value = self.value.get(scope.get('index').value)
+		if value is None:
+			raise KeyError(scope.get('index').value)
+		return value
+
+	def _has(self, scope: Scope) -> Value:
+		return FALSE if self.value.get(scope.get('index').value) is None else TRUE
+
+	def _assoc(self, scope: Scope) -> 'PersistentTableValue':
+		hamt = self.value.assoc(scope.get('index').value, scope.get('value'))
+		return self if hamt is self.value else PersistentTableValue(hamt)
+
+	def _dissoc(self, scope: Scope) -> 'PersistentTableValue':
+		hamt = self.value.dissoc(scope.get('index').value)
+		return self if hamt is self.value else PersistentTableValue(hamt)
+
+	def _count(self, scope: Scope) -> Value:
+		return box(self.value.count)
+
+	def _keys(self, scope: Scope) -> SeqValue:
+		hamt = self.value
+		return SeqValue(lambda scope: (Value(key) for key, value in hamt.items()))
+
+	def _values(self, scope: Scope) -> SeqValue:
+		hamt = self.value
+		return SeqValue(lambda scope: (value for key, value in hamt.items()))
+
+	def _to_table(self, scope: Scope) -> TableValue:
+		return TableValue(dict(self.value.items()))
+
+
+PersistentTableValue.methods = {
+	'get': Method(['index'], True, PersistentTableValue._get),
+	'has': Method(['index'], True, PersistentTableValue._has),
+	'assoc': Method(['index', 'value'], True, PersistentTableValue._assoc),
+	'dissoc': Method(['index'], True, PersistentTableValue._dissoc),
+	'count': Method([], True, PersistentTableValue._count),
+	'keys': Method([], True, PersistentTableValue._keys),
+	'values': Method([], True, PersistentTableValue._values),
+	'to_table': Method([], True, PersistentTableValue._to_table),
+}
+
+
+class PersistentListValue(Value):
+	__slots__ = ()
+
+	def __init__(self, value: Optional[Vector] = None):
+		super().__init__(value or Vector())
+
+	# Methods
+	def _get(self, scope: Scope) -> Value:
+		return self.value.get(int(scope.get('index').value))
+
+	def _assoc(self, scope: Scope) -> 'PersistentListValue':
+		return PersistentListValue(self.value.assoc(int(scope.get('index').value), scope.get('value')))
+
+	def _push(self, scope: Scope) -> 'PersistentListValue':
+		return PersistentListValue(self.value.push(scope.get('value')))
+
+	def _count(self, scope: Scope) -> Value:
+		return box(self.value.count)
+
+	def _seq(self, scope: Scope) -> SeqValue:
+		vector = self.value
+		return SeqValue(lambda scope: vector.items())
+
+	def _to_list(self, scope: Scope) -> ListValue:
+		return ListValue(list(self.value.items()))
+
+
+PersistentListValue.methods = {
+	'get': Method(['index'], True, PersistentListValue._get),
+	'assoc': Method(['index', 'value'], True, PersistentListValue._assoc),
+	'push': Method(['value'], True, PersistentListValue._push),
+	'count': Method([], True, PersistentListValue._count),
+	'seq': Method([], True, PersistentListValue._seq),
+	'to_list': Method([], True, PersistentListValue._to_list),
+}
+
+
+# Builtin: ptable(entries?) makes a persistent table, empty or with the entries of a table
+def ptable(scope: Scope) -> PersistentTableValue:
+	hamt = Hamt()
+	if scope.has_own('entries'):
+		entries = scope.get('entries')
+		if type(entries) is not TableValue:
+			raise RuntimeError("ptable() expects a table (value is: " + str(entries) + ")")
+		for key, value in entries.value.items():
+			hamt = hamt.assoc(key, value)
+	return PersistentTableValue(hamt)
+
+
+# Builtin: plist(items?) makes a persistent list, empty or with the items of a list or sequence
+def plist(scope: Scope) -> PersistentListValue:
+	vector = Vector()
+	if scope.has_own('items'):
+		items = scope.get('items')
+		if type(items) is ListValue:
+			values = items.value
+		elif type(items) is SeqValue:
+			values = items.value(scope)
+		else:
+			raise RuntimeError("plist() expects a list or sequence (value is: " + str(items) + ")")
+		for value in values:
+			vector = vector.push(value)
+	return PersistentListValue(vector)
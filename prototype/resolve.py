@@ -0,0 +1,106 @@
+from typing import Iterable, List, Optional, Set
+
+from prototype.nodes import Assign, Block, For, Func, If, Invoke, Name, Node, Program, Return, Var
+
+
+# Fills in `Name.depth` and `Assign.depth`: how many scopes up from the use the nearest scope that may
+# declare the name sits. Functions run in a child of their caller's scope, so names that are not
+# declared anywhere in the function itself are left free (None) and looked up at runtime, usually
+# ending up in the root scope through `Scope.get_global`.
+#
+# Declarations can be conditional (`if (c) { var x = 1; }`) or come after a use, so a depth is only
+# ever a hint. `Scope.get_at` checks the scope it points to and falls back to the usual walk.
+def resolve(program: Program) -> Program:
+	Resolver().region(program.body, [])
+	return program
+
+
+# Names a scope may declare: its own `var`/`const`s plus those in `if` branches, which do not make a
+# scope of their own. Functions, loops and other blocks are separate scopes and are not entered.
+def declarations(body: Iterable[Node]) -> Set[str]:
+	names = set()
+	pending = list(body)
+	while pending:
+		node = pending.pop()
+		kind = type(node)
+		if kind is Var:
+			names.add(node.name)
+		elif kind is Func or kind is Block or kind is For:
+			continue
+		elif kind is If:
+			for branch in (node.then, node.else_):
+				if type(branch) is Block:
+					pending.extend(branch.body)
+				elif branch is not None:
+					pending.append(branch)
+			pending.append(node.cond)
+			continue
+		pending.extend(node.children())
+	return names
+
+
+# Marks the calls whose result the function returns as is: the function's own body, what its block
+# returns and the branches of an `if` in any of those positions. See `prototype.interpreter.TailCall`.
+def mark_tail_calls(node: Node):
+	kind = type(node)
+	if kind is Invoke:
+		node.tail = True
+	elif kind is Return:
+		mark_tail_calls(node.value)
+	elif kind is Block:
+		for statement in node.body:
+			if type(statement) is Return:
+				mark_tail_calls(statement.value)
+				break
+	elif kind is If:
+		mark_tail_calls(node.then)
+		if node.else_ is not None:
+			mark_tail_calls(node.else_)
+
+
+class Resolver:
+	def region(self, body: List[Node], outer: List[Set[str]], extra: Iterable[str] = ()):
+		scopes = outer + [declarations(body) | set(extra)]
+		for statement in body:
+			self.visit(statement, scopes)
+
+	def lookup(self, name: str, scopes: List[Set[str]]) -> Optional[int]:
+		for depth, names in enumerate(reversed(scopes)):
+			if name in names:
+				return depth
+		return None
+
+	def visit(self, node: Node, scopes: List[Set[str]]):
+		kind = type(node)
+		if kind is Name:
+			node.depth = self.lookup(node.name, scopes)
+		elif kind is Assign:
+			node.depth = self.lookup(node.name, scopes)
+			self.visit(node.value, scopes)
+		elif kind is Block:
+			self.region(node.body, scopes)
+		elif kind is Func:
+			# A fresh chain: everything outside of the function depends on the caller
+			self.region([node.body], [], node.args)
+			mark_tail_calls(node.body)
+		elif kind is For:
+			body = node.statements()
+			if node.is_pure():
+				# The body's scope is a child of the loop's own, which declares nothing
+				scopes = scopes + [set()]
+				for child in (node.init, node.cond, node.step):
+					self.visit(child, scopes)
+			scopes = scopes + [declarations(body)]
+			for child in body if node.is_pure() else (node.init, node.cond, node.step, *body):
+				self.visit(child, scopes)
+		elif kind is If:
+			self.visit(node.cond, scopes)
+			for branch in (node.then, node.else_):
+				if type(branch) is Block:
+					for statement in branch.body:
+						self.visit(statement, scopes)
+				elif branch is not None:
+					self.visit(branch, scopes)
+		else:
+			for child in node.children():
+				self.visit(child, scopes)
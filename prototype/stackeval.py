@@ -0,0 +1,286 @@
+import sys
+import threading
+from typing import Any, Callable, List, Tuple
+
+from prototype.inline_cache import MemberCache
+from prototype.interpreter import FALSE, NONE, PROGRAM_FUNCTIONS, TRUE, FuncValue, Scope, Value, bind, box, format_template, string_literal
+from prototype.nodes import Assign, BinOp, Block, For, Func, If, Invoke, Literal, Logical, Member, Name, Node, Program, Return, String, Template, UnaryOp, Var
+
+
+# Evaluates the tree like `Scope.evaluate_expr`, but without recursing on the Python stack: pending
+# work is a list of (handler, argument, scope) and results go on a list of values, so nesting depth,
+# be it of expressions, blocks or calls between functions of the program, is only limited by memory.
+# Every node evaluated leaves exactly one value behind, statements included.
+Task = Tuple[Callable[[List['Task'], List[Value], Any, Scope], None], Any, Scope]
+
+
+# The callable of a function defined by a program running on this backend. The loop recognises it and
+# runs the body in place; anything else invoking it (builtins like `for_each`) starts a new loop.
+class StackFunction:
+	__slots__ = ('body',)
+	body: Node
+
+	def __init__(self, body: Node):
+		self.body = body
+
+	def __call__(self, scope: Scope) -> Value:
+		return evaluate(self.body, scope)
+
+
+PROGRAM_FUNCTIONS.add(StackFunction)
+
+
+def evaluate(node: Node, scope: Scope) -> Value:
+	values: List[Value] = []
+	work: List[Task] = [(HANDLERS[type(node)], node, scope)]
+	while work:
+		handler, arg, scope = work.pop()
+		handler(work, values, arg, scope)
+	return values.pop()
+
+
+def execute(program: Program, scope: Scope):
+	for statement in program.body:
+		evaluate(statement, scope)
+
+
+# The ANTLR parser and the passes over the tree recurse as deep as the program nests. They run on a
+# thread of their own, with a stack sized for `LOAD_RECURSION_LIMIT` frames, instead of raising the
+# recursion limit of the thread running the program.
+LOAD_STACK_SIZE = 512 * 1024 * 1024
+LOAD_RECURSION_LIMIT = 200_000
+
+def load(parse: Callable[[str], Program], file: str) -> Program:
+	result: List[Program] = []
+	error: List[BaseException] = []
+
+	def target():
+		try:
+			result.append(parse(file))
+		except BaseException as e:
+			error.append(e)
+
+	limit = sys.getrecursionlimit()
+	stack_size = threading.stack_size(LOAD_STACK_SIZE)
+	sys.setrecursionlimit(max(limit, LOAD_RECURSION_LIMIT))
+	try:
+		thread = threading.Thread(target = target, name = 'pipe-loader')
+		thread.start()
+		thread.join()
+	finally:
+		sys.setrecursionlimit(limit)
+		threading.stack_size(stack_size)
+	if error:
+		raise error[0]
+	return result[0]
+
+
+def push(work: List[Task], node: Node, scope: Scope):
+	work.append((HANDLERS[type(node)], node, scope))
+
+
+# Expressions
+def _literal(work: List[Task], values: List[Value], expr: Literal, scope: Scope):
+	values.append(box(expr.value))
+
+def _string(work: List[Task], values: List[Value], expr: String, scope: Scope):
+	values.append(string_literal(expr.text))
+
+def _template(work: List[Task], values: List[Value], expr: Template, scope: Scope):
+	work.append((_format, expr.strings, scope))
+	for part in reversed(expr.exprs):
+		push(work, part, scope)
+
+def _format(work: List[Task], values: List[Value], strings: List[str], scope: Scope):
+	count = len(strings) - 1
+	parts = values[-count:]
+	del values[-count:]
+	values.append(format_template(strings, parts))
+
+def _name(work: List[Task], values: List[Value], expr: Name, scope: Scope):
+	values.append(scope.get_global(expr.name) if expr.depth is None else scope.get_at(expr.depth, expr.name))
+
+def _member(work: List[Task], values: List[Value], expr: Member, scope: Scope):
+	if expr.cache is None:
+		expr.cache = MemberCache(expr.name)
+	work.append((_get_member, expr.cache, scope))
+	push(work, expr.target, scope)
+
+def _get_member(work: List[Task], values: List[Value], cache: MemberCache, scope: Scope):
+	values.append(cache.get(values.pop()))
+
+def _unary_op(work: List[Task], values: List[Value], expr: UnaryOp, scope: Scope):
+	if expr.op == 'not':
+		work.append((_not, None, scope))
+		push(work, expr.operand, scope)
+	else:
+		values.append(scope.step(expr.operand.depth, expr.operand.name, expr.op))
+
+def _not(work: List[Task], values: List[Value], arg: None, scope: Scope):
+	values.append(FALSE if values.pop().value else TRUE)
+
+def _bin_op(work: List[Task], values: List[Value], expr: BinOp, scope: Scope):
+	work.append((_apply_bin_op, expr.op, scope))
+	push(work, expr.right, scope)
+	push(work, expr.left, scope)
+
+def _apply_bin_op(work: List[Task], values: List[Value], op: str, scope: Scope):
+	right = values.pop()
+	values.append(getattr(values.pop(), op)(right))
+
+def _logical(work: List[Task], values: List[Value], expr: Logical, scope: Scope):
+	work.append((_short_circuit, expr, scope))
+	push(work, expr.left, scope)
+
+def _short_circuit(work: List[Task], values: List[Value], expr: Logical, scope: Scope):
+	# The left value stays as the result unless the right side has to be evaluated
+	if bool(values[-1].value) == (expr.op == 'and'):
+		values.pop()
+		push(work, expr.right, scope)
+
+def _func(work: List[Task], values: List[Value], expr: Func, scope: Scope):
+	values.append(FuncValue(expr.args, expr.is_pure, StackFunction(expr.body)))
+
+def _invoke(work: List[Task], values: List[Value], expr: Invoke, scope: Scope):
+	# The function first, then the arguments from left to right
+	work.append((_call, len(expr.args), scope))
+	for arg in reversed(expr.args):
+		push(work, arg, scope)
+	push(work, expr.func, scope)
+
+def _call(work: List[Task], values: List[Value], count: int, scope: Scope):
+	if count:
+		args = values[-count:]
+		del values[-count:]
+	else:
+		args = []
+	func = values.pop()
+	if type(func) is not FuncValue or type(func.value) is not StackFunction:
+		values.append(scope.invoke(func, args))
+		return
+	if not func.is_pure and scope.pure:
+		raise RuntimeError("Cannot invoke impure functions in a pure scope.")
+	child_scope = scope.make_child_scope(func.is_pure)
+	bind(child_scope, func, args)
+	push(work, func.value.body, child_scope)
+
+def _block(work: List[Task], values: List[Value], expr: Block, scope: Scope):
+	_run_block(work, values, expr, scope.make_child_scope(expr.is_pure))
+
+# A block running in `scope` itself, like the branches of an `if`
+def _run_block(work: List[Task], values: List[Value], expr: Block, scope: Scope):
+	# Stands in for the value of the statement before the first one
+	values.append(NONE)
+	work.append((_next_statement, iter(expr.body), scope))
+
+def _next_statement(work: List[Task], values: List[Value], statements: Any, scope: Scope):
+	values.pop()
+	statement = next(statements, None)
+	if statement is None:
+		values.append(NONE)
+	elif type(statement) is Return:
+		push(work, statement.value, scope)
+	else:
+		work.append((_next_statement, statements, scope))
+		push(work, statement, scope)
+
+def _if(work: List[Task], values: List[Value], expr: If, scope: Scope):
+	work.append((_branch, expr, scope))
+	push(work, expr.cond, scope)
+
+def _branch(work: List[Task], values: List[Value], expr: If, scope: Scope):
+	branch = expr.then if values.pop().is_truthy() else expr.else_
+	if branch is None:
+		values.append(NONE)
+	elif type(branch) is Block:
+		_run_block(work, values, branch, scope)
+	else:
+		push(work, branch, scope)
+
+def _for(work: List[Task], values: List[Value], expr: For, scope: Scope):
+	scope = scope.make_child_scope(False)
+	work.append((_loop, expr, scope))
+	push(work, expr.init, scope)
+
+# After the init or the step: check the condition
+def _loop(work: List[Task], values: List[Value], expr: For, scope: Scope):
+	values.pop()
+	work.append((_iterate, expr, scope))
+	push(work, expr.cond, scope)
+
+def _iterate(work: List[Task], values: List[Value], expr: For, scope: Scope):
+	if not values.pop().is_truthy():
+		values.append(NONE)
+		return
+	# A pure body gets a new scope every iteration, see `For`
+	if expr.is_pure():
+		body = scope.make_child_scope(True)
+	else:
+		body = scope
+		if scope.scope:
+			scope.reset()
+	values.append(NONE)
+	work.append((_next_loop_statement, (expr, iter(expr.statements()), scope), body))
+
+def _next_loop_statement(work: List[Task], values: List[Value], state: Tuple[For, Any, Scope], scope: Scope):
+	values.pop()
+	expr, statements, loop_scope = state
+	statement = next(statements, None)
+	if statement is None:
+		work.append((_loop, expr, loop_scope))
+		push(work, expr.step, loop_scope)
+	elif type(statement) is Return:
+		# Leaves the loop with the value
+		push(work, statement.value, scope)
+	else:
+		work.append((_next_loop_statement, state, scope))
+		push(work, statement, scope)
+
+
+# Statements
+def _var(work: List[Task], values: List[Value], stat: Var, scope: Scope):
+	work.append((_declare, stat, scope))
+	push(work, stat.value, scope)
+
+def _declare(work: List[Task], values: List[Value], stat: Var, scope: Scope):
+	scope.new(stat.name, values.pop(), stat.is_const)
+	values.append(NONE)
+
+def _assign(work: List[Task], values: List[Value], stat: Assign, scope: Scope):
+	work.append((_store, stat, scope))
+	push(work, stat.value, scope)
+
+def _store(work: List[Task], values: List[Value], stat: Assign, scope: Scope):
+	if stat.depth is None:
+		scope.assign(stat.name, values.pop())
+	else:
+		scope.assign_at(stat.depth, stat.name, values.pop())
+	values.append(NONE)
+
+def _return(work: List[Task], values: List[Value], stat: Return, scope: Scope):
+	work.append((_set_returned, None, scope))
+	push(work, stat.value, scope)
+
+def _set_returned(work: List[Task], values: List[Value], arg: None, scope: Scope):
+	scope.returned_value = values[-1]
+
+
+# Node type -> handler starting its evaluation
+HANDLERS = {
+	Literal: _literal,
+	String: _string,
+	Template: _template,
+	Name: _name,
+	Member: _member,
+	UnaryOp: _unary_op,
+	BinOp: _bin_op,
+	Logical: _logical,
+	Func: _func,
+	Invoke: _invoke,
+	Block: _block,
+	If: _if,
+	For: _for,
+	Var: _var,
+	Assign: _assign,
+	Return: _return,
+}
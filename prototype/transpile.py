@@ -0,0 +1,204 @@
+import os
+from types import ModuleType
+from typing import List, Optional
+
+from prototype.cache import INTERPRETER_TAG, source_hash
+from prototype.interpreter import Scope
+from prototype.nodes import Assign, BinOp, Block, For, Func, If, Invoke, Literal, Logical, Member, Name, Node, Program, Return, String, Template, UnaryOp, Var
+from prototype.resolve import declarations
+
+
+# Emits a Python module for a program so that CPython compiles and runs it directly. Variables still
+# live in `Scope`s, so generated code interoperates with builtins and the other backends. Every
+# function and block body becomes a module-level `def` taking the scope to run in, and the program
+# itself becomes `execute(scope)`.
+class Transpiler:
+	definitions: List[str]
+	counter: int
+
+	def __init__(self):
+		self.definitions = []
+		self.counter = 0
+
+	def unique(self, prefix: str) -> str:
+		self.counter += 1
+		return f'_{prefix}{self.counter}'
+
+	def define(self, name: str, body: List[str]):
+		self.definitions.append(f'def {name}(scope):\n' + ''.join(f'\t{line}\n' for line in body))
+
+	# Values never change, so each literal is boxed once when the module loads
+	def constant(self, expr: Node) -> str:
+		if type(expr) is Literal:
+			value = expr.value
+			if value is None or type(value) is bool:
+				return repr(value).upper()
+			boxed = f'box({value!r})'
+		else:
+			boxed = f'string_literal({expr.text!r})'
+		name = self.unique('const')
+		self.definitions.append(f'{name} = {boxed}\n')
+		return name
+
+	# Returns the lines for a statement whose value is discarded
+	def stat(self, stat: Node) -> List[str]:
+		kind = type(stat)
+		if kind is Var:
+			if stat.is_const:
+				return [f'scope.new({stat.name!r}, {self.expr(stat.value)}, True)']
+			return [f'scope.new({stat.name!r}, {self.expr(stat.value)})']
+		elif kind is Assign:
+			if stat.depth is None:
+				return [f'scope.assign({stat.name!r}, {self.expr(stat.value)})']
+			return [f'scope.assign_at({stat.depth}, {stat.name!r}, {self.expr(stat.value)})']
+		elif kind is Return:
+			return [f'scope.returned_value = {self.expr(stat.value)}']
+		return [self.expr(stat)]
+
+	# Returns the lines for a statement followed by a `return` of its value, like `Scope.evaluate_stat`
+	def stat_value(self, stat: Node) -> List[str]:
+		kind = type(stat)
+		if kind is Return:
+			return self.stat(stat) + ['return scope.returned_value']
+		elif kind is Var or kind is Assign:
+			return self.stat(stat) + ['return NONE']
+		return [f'return {self.expr(stat)}']
+
+	def expr(self, expr: Node, make_scope: bool = True) -> str:
+		kind = type(expr)
+		if kind is Literal or kind is String:
+			return self.constant(expr)
+		elif kind is Template:
+			strings = self.unique('strings')
+			self.definitions.append(f'{strings} = {expr.strings!r}\n')
+			parts = ', '.join(self.expr(part) for part in expr.exprs)
+			return f'format_template({strings}, [{parts}])'
+		elif kind is Name:
+			if expr.depth is None:
+				return f'scope.get_global({expr.name!r})'
+			return f'scope.get_at({expr.depth}, {expr.name!r})'
+		elif kind is Member:
+			cache = self.unique('member')
+			self.definitions.append(f'{cache} = MemberCache({expr.name!r}).get\n')
+			return f'{cache}({self.expr(expr.target)})'
+		elif kind is UnaryOp:
+			if expr.op == 'not':
+				return f'(FALSE if {self.expr(expr.operand)}.value else TRUE)'
+			return f'scope.step({expr.operand.depth!r}, {expr.operand.name!r}, {expr.op!r})'
+		elif kind is BinOp:
+			return f'{self.expr(expr.left)}.{expr.op}({self.expr(expr.right)})'
+		elif kind is Logical:
+			temp = self.unique('t')
+			left = f'({temp} := {self.expr(expr.left)}).value'
+			if expr.op == 'and':
+				return f'({self.expr(expr.right)} if {left} else {temp})'
+			return f'({temp} if {left} else {self.expr(expr.right)})'
+		elif kind is Func:
+			name = self.unique('func')
+			self.define(name, self.stat_value(expr.body))
+			# Made once when the module loads, like the function's def
+			function = self.unique('function')
+			self.definitions.append(f'{function} = Function({name})\n')
+			return f'FuncValue({tuple(expr.args)!r}, {expr.is_pure!r}, {function})'
+		elif kind is Invoke:
+			invoke = 'tail_invoke' if expr.tail else 'invoke'
+			return f'scope.{invoke}({self.expr(expr.func)}, [{", ".join(self.expr(arg) for arg in expr.args)}])'
+		elif kind is Block:
+			name = self.unique('block')
+			body = []
+			for statement in expr.body:
+				if type(statement) is Return:
+					body.append(f'return {self.expr(statement.value)}')
+					break
+				body.extend(self.stat(statement))
+			else:
+				body.append('return NONE')
+			self.define(name, body)
+			if make_scope:
+				return f'{name}(scope.make_child_scope({expr.is_pure!r}))'
+			return f'{name}(scope)'
+		elif kind is If:
+			else_ = 'NONE' if expr.else_ is None else self.expr(expr.else_, make_scope = False)
+			return f'({self.expr(expr.then, make_scope = False)} if {self.expr(expr.cond)}.is_truthy() else {else_})'
+		elif kind is For:
+			name = self.unique('for')
+			body = expr.statements()
+			lines = []
+			returns = False
+			for statement in body:
+				if type(statement) is Return:
+					lines.append(f'return {self.expr(statement.value)}')
+					returns = True
+					break
+				lines.extend(self.stat(statement))
+			if expr.is_pure():
+				# A new pure scope every iteration, see `For`
+				body_name = self.unique('for_body')
+				self.define(body_name, lines if returns else lines + ['return NONE'])
+				call = f'{body_name}(scope.make_child_scope(True))'
+				loop = [f'return {call}' if returns else call]
+			else:
+				loop = (['scope.reset()'] if declarations(body) else []) + lines
+			if not returns:
+				loop.append(self.expr(expr.step))
+			self.define(name, [
+				self.expr(expr.init),
+				f'while {self.expr(expr.cond)}.is_truthy():',
+				*(f'\t{line}' for line in loop),
+				'return NONE',
+			])
+			return f'{name}(scope.make_child_scope(False))'
+		raise RuntimeError(f"Cannot transpile node: {expr!r}")
+
+
+# What a compiled module starts with after its imports: the hash of its source and the tag of the
+# interpreter it was compiled against
+def header(digest: str) -> str:
+	return f'SOURCE_HASH = {digest!r}\nINTERPRETER_TAG = {INTERPRETER_TAG!r}\n'
+
+
+def transpile(program: Program, file: str, digest: str = '') -> str:
+	transpiler = Transpiler()
+	body = []
+	for statement in program.body:
+		body.extend(transpiler.stat(statement))
+	transpiler.define('execute', body or ['pass'])
+	return '\n\n'.join([
+		f'# Generated by `python -m prototype compile` from {file}, do not edit.\n'
+		'from prototype.inline_cache import MemberCache\n'
+		'from prototype.interpreter import FALSE, NONE, TRUE, FuncValue, Function, box, format_template, string_literal\n\n'
+		+ header(digest),
+		*transpiler.definitions,
+	])
+
+
+# Used when nothing was compiled ahead of time: transpiles in memory and runs the result
+def execute(program: Program, scope: Scope):
+	namespace = {}
+	exec(compile(transpile(program, '<memory>'), '<pipe>', 'exec'), namespace)
+	namespace['execute'](scope)
+
+
+# foo.pipe -> foo_pipe.py, which is where `run` looks for a compiled module
+def compiled_path(file: str) -> str:
+	root, ext = os.path.splitext(file)
+	return f'{root}_{ext[1:] or "pipe"}.py'
+
+
+# Loads the compiled module for `file`, if there is one and it was generated from the current source
+# by the current interpreter. The header is checked before anything in the module runs.
+def load_compiled(file: str) -> Optional[ModuleType]:
+	path = compiled_path(file)
+	if not os.path.exists(path):
+		return None
+	with open(file, 'rb') as f:
+		digest = source_hash(f.read())
+	with open(path, encoding = 'utf-8') as f:
+		text = f.read()
+	# Definitions follow the header after two blank lines, see `transpile`
+	if header(digest) not in text.partition('\n\n\n')[0] + '\n':
+		return None
+	module = ModuleType(f'pipe_{digest}')
+	module.__file__ = path
+	exec(compile(text, path, 'exec'), module.__dict__)
+	return module
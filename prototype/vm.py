@@ -0,0 +1,160 @@
+from typing import List, Tuple
+
+from prototype.bytecode import *
+from prototype.interpreter import FALSE, PROGRAM_FUNCTIONS, TRUE, FuncValue, Scope, Value, bind, format_template, tail_scope
+from prototype.nodes import Program
+
+
+# The callable stored in a `FuncValue` made by MAKE_FUNC. The VM recognises it and runs the body in
+# a new frame of the same loop; anything else invoking it (builtins like `for_each`) starts a new loop.
+class CompiledFunction:
+	__slots__ = ('code',)
+	code: Code
+
+	def __init__(self, code: Code):
+		self.code = code
+
+	def __call__(self, scope: Scope) -> Value:
+		return run(self.code, scope)
+
+
+PROGRAM_FUNCTIONS.add(CompiledFunction)
+
+
+# What a call has to restore once the callee returns: the caller's instructions, pc, stack, scope and
+# the scope of the caller's own call
+Frame = Tuple[List[Instruction], int, List[Value], Scope, Scope]
+
+
+def run(code: Code, scope: Scope) -> Value:
+	instructions = code.instructions
+	pc = 0
+	stack: List[Value] = []
+	frames: List[Frame] = []
+	# The scope the running function was called with, see `tail_scope`
+	call_scope = scope
+
+	while True:
+		op, arg = instructions[pc]
+		pc += 1
+
+		if op == LOAD_LOCAL:
+			# Variables of the current scope and of the one around it skip the walk in `get_at`
+			depth, name = arg
+			if depth == 0:
+				variables = scope.scope
+			elif depth == 1 and not scope.pure:
+				variables = scope.parent.scope
+			else:
+				variables = None
+			if variables is not None and name in variables:
+				stack.append(variables[name])
+			else:
+				stack.append(scope.get_at(depth, name))
+		elif op == LOAD_CONST:
+			stack.append(arg)
+		elif op == BINARY_OP:
+			right = stack.pop()
+			stack[-1] = getattr(stack[-1], arg)(right)
+		elif op == BINARY_OP_CONST:
+			stack[-1] = getattr(stack[-1], arg[0])(arg[1])
+		elif op == STORE_LOCAL:
+			depth, name = arg
+			if depth == 0:
+				target = scope
+			elif depth == 1 and not scope.pure:
+				target = scope.parent
+			else:
+				target = None
+			if target is not None and name in target.scope and (target.consts is None or name not in target.consts):
+				target.scope[name] = stack.pop()
+			else:
+				scope.assign_at(depth, name, stack.pop())
+		elif op == POP_JUMP_IF_FALSE:
+			if stack.pop().value is not True:
+				pc = arg
+		elif op == JUMP:
+			pc = arg
+		elif op == INC:
+			value = scope.step(arg[0], arg[1], 'inc')
+			if arg[2]:
+				stack.append(value)
+		elif op == POP_TOP:
+			stack.pop()
+		elif op == CALL or op == TAIL_CALL:
+			if arg:
+				args = stack[-arg:]
+				del stack[-arg:]
+			else:
+				args = []
+			func = stack.pop()
+			if not isinstance(func, FuncValue):
+				raise RuntimeError("Attempted to invoke a non-FuncValue value (value is: " + str(func) + ")")
+			if not func.is_pure and scope.pure:
+				raise RuntimeError("Cannot invoke impure functions in a pure scope.")
+			if type(func.value) is CompiledFunction:
+				if op == CALL:
+					frames.append((instructions, pc, stack, scope, call_scope))
+					scope = scope.make_child_scope(func.is_pure)
+					bind(scope, func, args)
+				else:
+					# Nothing is left to do in this frame, so the callee takes it over
+					scope = tail_scope(call_scope, scope, func, args)
+				call_scope = scope
+				instructions = func.value.code.instructions
+				pc = 0
+				stack = []
+			else:
+				stack.append(func.invoke(scope, args))
+		elif op == RETURN_VALUE:
+			value = stack.pop()
+			if not frames:
+				return value
+			instructions, pc, stack, scope, call_scope = frames.pop()
+			stack.append(value)
+		elif op == LOAD_GLOBAL:
+			stack.append(scope.get_global(arg))
+		elif op == GET_MEMBER:
+			stack.append(arg.get(stack.pop()))
+		elif op == STORE_NEW:
+			scope.new(arg[0], stack.pop(), arg[1])
+		elif op == CLEAR_SCOPE:
+			scope.reset()
+		elif op == JUMP_IF_FALSE_OR_POP:
+			if stack[-1].value:
+				stack.pop()
+			else:
+				pc = arg
+		elif op == JUMP_IF_TRUE_OR_POP:
+			if stack[-1].value:
+				pc = arg
+			else:
+				stack.pop()
+		elif op == UNARY_NOT:
+			stack.append(FALSE if stack.pop().value else TRUE)
+		elif op == DEC:
+			value = scope.step(arg[0], arg[1], 'dec')
+			if arg[2]:
+				stack.append(value)
+		elif op == STORE_NAME:
+			scope.assign(arg, stack.pop())
+		elif op == PUSH_SCOPE:
+			scope = scope.make_child_scope(scope.pure if arg is None else arg)
+		elif op == POP_SCOPE:
+			scope = scope.parent
+		elif op == SET_RETURNED:
+			scope.returned_value = stack[-1]
+		elif op == MAKE_FUNC:
+			args, is_pure, body = arg
+			stack.append(FuncValue(args, is_pure, CompiledFunction(body)))
+		elif op == FORMAT:
+			count = len(arg) - 1
+			values = stack[-count:]
+			del stack[-count:]
+			stack.append(format_template(arg, values))
+		else:
+			raise RuntimeError(f"Unknown opcode: {op}")
+
+
+def execute(program: Program, scope: Scope):
+	run(compile_program(program), scope)